@@ -230,6 +230,13 @@ TELEGRAM_WEBHOOK_SECRET = env('TELEGRAM_WEBHOOK_SECRET', default='')
 TELEGRAM_BASE_WEBHOOK_URL = env('TELEGRAM_BASE_WEBHOOK_URL', default='')
 
 TELEGRAM_BOT_STORAGE_REDIS_URL = env('TELEGRAM_BOT_STORAGE_REDIS_URL', default='redis://localhost:6379/2')
+# parallel MTProto connections of one media transfer
+TELEGRAM_TRANSFER_CONNECTIONS = env.int('TELEGRAM_TRANSFER_CONNECTIONS', default=4)
+# stream media from the source account to the sender without saving it to ./downloads
+TELEGRAM_RELAY_MEDIA = env.bool('TELEGRAM_RELAY_MEDIA', default=False)
+# bytes of downloaded media kept on disk for repeated requests, least recently used files are deleted first,
+# 0 deletes every file once it's sent, size the downloads volume for the cache before enabling it
+TELEGRAM_MEDIA_CACHE_SIZE = env.int('TELEGRAM_MEDIA_CACHE_SIZE', default=0)
 
 GOOGLE_GEMINI_API_KEYS = env('GOOGLE_GEMINI_API_KEYS', default='').split(',')
 OPENAI_API_KEY = env('OPENAI_API_KEY', default='')
@@ -238,3 +245,11 @@ TELEGRAM_SESSION_SECRET_KEY = env(
     'TELEGRAM_SESSION_SECRET_KEY',
     default='iW3VlV4p-Tfo3qB107uwDjZVGwZT07d_PDHYkOllIig=',
 )
+
+# Workflows settings
+WORKFLOWS_RETENTION_DAYS = env.int('WORKFLOWS_RETENTION_DAYS', default=30)
+WORKFLOWS_ARCHIVE_DIR = env('WORKFLOWS_ARCHIVE_DIR', default=str(BASE_DIR / 'data/workflows'))
+# port of the Prometheus metrics endpoint of workers, 0 disables it
+WORKFLOWS_METRICS_PORT = env.int('WORKFLOWS_METRICS_PORT', default=0)
+# shared state of workflow rate limits, without it every worker limits only itself
+WORKFLOWS_REDIS_URL = env('WORKFLOWS_REDIS_URL', default=None)
@@ -30,6 +30,7 @@ from telegram_bot.services.restricted_downloader import (
     save_account_data,
 )
 from telegram_bot.states.restricted_downloader import RestrictedDownloaderForm
+from telegram_restricted_downloader.clients import client_pool
 from telegram_restricted_downloader.helpers import CustomTelethonClient
 from telegram_restricted_downloader.models import Account
 from users.models import User
@@ -279,10 +280,7 @@ async def callback_select_account(
     me = None
     try:
         if account.session_string:
-            client = CustomTelethonClient(
-                StringSession(account.session_string), settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH,
-            )
-            await client.connect()
+            client = await client_pool.get(account)
             me = await client.get_me()
     except Exception as e:
         logger.exception(e)
@@ -354,12 +352,7 @@ async def download_telegram_message(
     client, me = None, None
     try:
         if account.session_string:
-            client = CustomTelethonClient(
-                StringSession(account.session_string),
-                settings.TELEGRAM_API_ID,
-                settings.TELEGRAM_API_HASH,
-            )
-            await client.connect()
+            client = await client_pool.get(account)
             me = await client.get_me()
     except Exception as e:
         logger.exception(e)
@@ -456,12 +449,7 @@ async def start_downloading(callback_query: CallbackQuery, state: FSMContext) ->
     client, me = None, None
     try:
         if account.session_string:
-            client = CustomTelethonClient(
-                StringSession(account.session_string),
-                settings.TELEGRAM_API_ID,
-                settings.TELEGRAM_API_HASH,
-            )
-            await client.connect()
+            client = await client_pool.get(account)
             me = await client.get_me()
     except Exception as e:
         logger.exception(e)
@@ -511,12 +499,7 @@ async def inline_select_dialog(
     client, me = None, None
     try:
         if account.session_string:
-            client = CustomTelethonClient(
-                StringSession(account.session_string),
-                settings.TELEGRAM_API_ID,
-                settings.TELEGRAM_API_HASH,
-            )
-            await client.connect()
+            client = await client_pool.get(account)
             me = await client.get_me()
     except Exception as e:
         logger.exception(e)
@@ -5,7 +5,7 @@ from djangoql.admin import DjangoQLSearchMixin
 
 from utils.helpers import model_link
 
-from .models import Account
+from .models import Account, MediaCache, MediaCacheReference
 
 
 @admin.register(Account)
@@ -50,3 +50,48 @@ class AccountAdmin(DjangoQLSearchMixin, admin.ModelAdmin):
         return '-'
 
     user_link.short_description = _('User')
+
+
+class MediaCacheReferenceInline(admin.TabularInline):
+    model = MediaCacheReference
+
+    fields = (
+        'sender_key',
+        'document_id',
+        'created_at',
+    )
+
+    readonly_fields = fields
+
+    extra = 0
+    can_delete = True
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MediaCache)
+class MediaCacheAdmin(admin.ModelAdmin):
+    list_display = (
+        'document_id',
+        'file_path',
+        'size',
+        'used_at',
+    )
+
+    search_fields = ('document_id',)
+
+    readonly_fields = (
+        'document_id',
+        'file_path',
+        'size',
+        'created_at',
+        'used_at',
+    )
+
+    inlines = (MediaCacheReferenceInline,)
+
+    ordering = ('-used_at',)
+
+    def has_add_permission(self, request):
+        return False
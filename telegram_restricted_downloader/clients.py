@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from time import monotonic
+from weakref import WeakSet
+
+from django.conf import settings
+from telethon import TelegramClient
+from telethon.sessions import MemorySession, StringSession
+
+from telegram_restricted_downloader.helpers import CustomTelethonClient
+from telegram_restricted_downloader.models import Account
+
+# clients unused for this long are disconnected
+IDLE_TIMEOUT = 10 * 60
+# how often idle clients are looked for
+IDLE_CHECK_INTERVAL = 60
+# authorisation of a client is checked again after this time
+HEALTH_CHECK_INTERVAL = 60
+RECONNECT_BASE_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+class ClientUnavailableError(ConnectionError):
+    pass
+
+
+@dataclass
+class PooledClient:
+    client: TelegramClient
+    session_string: str | None
+    used_at: float = field(default_factory=monotonic)
+    checked_at: float = None
+    failures: int = 0
+    retry_at: float = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # tasks that borrowed the client, it isn't idle while one of them runs
+    tasks: WeakSet = field(default_factory=WeakSet)
+
+    @property
+    def in_use(self) -> bool:
+        return any(not task.done() for task in self.tasks)
+
+
+class ClientPool:
+    """
+    Connected Telethon clients of this process keyed by account id, or the bot.
+    Clients are checked when borrowed at most every health check interval, failed connections are retried
+    with exponential backoff and idle clients are disconnected by a background task.
+    Clients belong to the event loop that connected them, a new loop starts with an empty pool
+    """
+
+    def __init__(
+            self,
+            idle_timeout: float = IDLE_TIMEOUT,
+            health_check_interval: float = HEALTH_CHECK_INTERVAL,
+            idle_check_interval: float = IDLE_CHECK_INTERVAL,
+    ):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.idle_check_interval = idle_check_interval
+        self.clients: dict[str, PooledClient] = {}
+        self.loop = None
+        self.reaper = None
+
+    def get_key(self, account: Account = None) -> str:
+        return f'account:{account.id}' if account else 'bot'
+
+    def create_client(self, account: Account = None) -> PooledClient:
+        if account:
+            client = CustomTelethonClient(
+                StringSession(account.session_string), settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH,
+            )
+            return PooledClient(client, account.session_string)
+
+        client = TelegramClient(MemorySession(), settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH)
+        return PooledClient(client, None)
+
+    async def get(self, account: Account = None, bot_token: str = settings.TELEGRAM_BOT_TOKEN) -> TelegramClient:
+        """Connected and authorised client of the account, or of the bot without an account"""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.clients = {}
+            self.loop = loop
+            self.reaper = None
+
+        if self.reaper is None or self.reaper.done():
+            # clients of accounts nobody borrows anymore are closed too
+            self.reaper = asyncio.create_task(self.reap_idle())
+
+        key = self.get_key(account)
+        pooled = self.clients.get(key)
+        if pooled and account and pooled.session_string != account.session_string:
+            # the account was logged in again
+            await self.close_client(key)
+            pooled = None
+        if not pooled:
+            pooled = self.clients[key] = self.create_client(account)
+
+        async with pooled.lock:
+            await self.ensure_connected(key, pooled, bot_token)
+        pooled.used_at = monotonic()
+        pooled.tasks.add(asyncio.current_task())
+        return pooled.client
+
+    async def ensure_connected(self, key: str, pooled: PooledClient, bot_token: str):
+        connected = pooled.client.is_connected()
+        if connected and pooled.checked_at and monotonic() - pooled.checked_at < self.health_check_interval:
+            return
+
+        if not pooled.session_string and not bot_token:
+            raise ClientUnavailableError('Neither an account nor a bot token is given')
+        if monotonic() < pooled.retry_at:
+            raise ClientUnavailableError(f'Client {key} reconnects in {pooled.retry_at - monotonic():.0f}s')
+
+        try:
+            if not connected:
+                if pooled.session_string:
+                    await pooled.client.connect()
+                else:
+                    await pooled.client.start(bot_token=bot_token)
+            if not await pooled.client.is_user_authorized():
+                raise ClientUnavailableError(f'Client {key} is not authorised')
+        except Exception as e:
+            pooled.failures += 1
+            delay = min(RECONNECT_BASE_DELAY * 2 ** (pooled.failures - 1), RECONNECT_MAX_DELAY)
+            pooled.retry_at = monotonic() + delay
+            logging.warning(f'Client {key} failed to connect ({pooled.failures} times), retrying in {delay}s: {e}')
+            await pooled.client.disconnect()
+            raise
+
+        pooled.failures = 0
+        pooled.checked_at = monotonic()
+
+    async def reap_idle(self):
+        while True:
+            await asyncio.sleep(self.idle_check_interval)
+            await self.close_idle()
+
+    async def close_idle(self):
+        for key, pooled in list(self.clients.items()):
+            if monotonic() - pooled.used_at > self.idle_timeout and not pooled.lock.locked() and not pooled.in_use:
+                await self.close_client(key)
+
+    async def close_client(self, key: str):
+        pooled = self.clients.pop(key, None)
+        if pooled:
+            try:
+                await pooled.client.disconnect()
+            except OSError as e:
+                logging.warning(f'Failed to disconnect client {key}: {e}')
+
+    async def close(self):
+        if self.reaper:
+            self.reaper.cancel()
+            self.reaper = None
+        for key in list(self.clients):
+            await self.close_client(key)
+
+
+client_pool = ClientPool()
@@ -1,6 +1,7 @@
 import ipaddress
 import struct
 import time
+from collections import OrderedDict
 
 from telethon import TelegramClient
 from telethon.sessions import StringSession
@@ -22,90 +23,6 @@ def humanbytes(size: int) -> str:
     return f'{round(size, 2)} {dic_power_n[n]}B'
 
 
-class DownloadStats:
-    def __init__(self, current: int, speed: float, time_left: float, downloaded: int, total: int):
-        self.current = current
-        self.speed = speed
-        self.time_left = time_left
-        self.downloaded = downloaded
-        self.total = total
-
-    @property
-    def progress_percentage(self) -> float:
-        return (self.current / self.total) * 100 if self.total > 0 else 0
-
-    def format_time(self, seconds: float) -> str:
-        seconds = int(seconds)
-        minutes, seconds = divmod(seconds, 60)
-        hours, minutes = divmod(minutes, 60)
-        days, hours = divmod(hours, 24)
-        tmp = ''
-        if days > 0:
-            tmp += f'{days}d, '
-        if hours > 0:
-            tmp += f'{hours}h, '
-        if minutes > 0:
-            tmp += f'{minutes}m, '
-        if seconds > 0:
-            tmp += f'{seconds}s'
-        return tmp.strip(', ')
-
-    def __repr__(self):
-        return (
-            f'DownloadStats(progress={self.progress_percentage:.2f}%, '
-            f'speed={humanbytes(int(self.speed))}/s, '
-            f'downloaded={humanbytes(self.downloaded)} / {humanbytes(self.total)}, '
-            f'time_left={self.format_time(self.time_left)})'
-        )
-
-
-class ProgressTracker:
-    def __init__(self, total: int = 0):
-        self.total = total
-        self.start_time = time.time()
-        self.last_time = self.start_time
-        self.last_bytes = 0
-        self.speed = 0
-        self.current = 0
-        self.time_left = float('inf')
-        self.stats = DownloadStats(
-            current=self.current,
-            speed=self.speed,
-            time_left=self.time_left,
-            downloaded=0,
-            total=0,
-        )
-
-    def callback(self, current: int, total: int) -> DownloadStats:
-        self.current = current
-        self.total = total
-        current_time = time.time()
-        delta_time = current_time - self.last_time
-        delta_bytes = current - self.last_bytes
-
-        # Update last tracked time and bytes
-        self.last_time = current_time
-        self.last_bytes = current
-
-        # Calculate download speed (bytes per second)
-        self.speed = delta_bytes / delta_time if delta_time > 0 else 0
-
-        # Calculate estimated time left
-        bytes_left = self.total - current
-        self.time_left = bytes_left / self.speed if self.speed > 0 else float('inf')
-
-        # Create the stats object
-        self.stats = DownloadStats(
-            current=self.current,
-            speed=self.speed,
-            time_left=self.time_left,
-            downloaded=self.current,
-            total=self.total,
-        )
-
-        return self.stats
-
-
 class CustomTelethonClient(TelegramClient):
     def get_session_string(self):
         ip = ipaddress.ip_address(self.session.server_address).packed
@@ -115,3 +32,42 @@ class CustomTelethonClient(TelegramClient):
                 self.session.auth_key.key,
             ),
         )
+
+
+class TTLCache:
+    """Mapping of at most max_size items, the least recently used are dropped first and items expire after ttl"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self.items.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self.items[key]
+            return default
+
+        self.items.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, self) is not self
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self.items.pop(key, None)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.items)
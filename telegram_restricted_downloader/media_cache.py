@@ -0,0 +1,84 @@
+import logging
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils.timezone import now
+from telethon.tl.types import InputDocument
+
+from telegram_restricted_downloader.models import MediaCache, MediaCacheReference
+
+
+async def get_cached_file(document) -> str | None:
+    """Path of the complete local file of the document, if it's still cached"""
+    media = await MediaCache.objects.filter(document_id=document.id, file_path__isnull=False).afirst()
+    if not media:
+        return None
+
+    path = Path(media.file_path)
+    if not path.exists() or path.stat().st_size != document.size:
+        await MediaCache.objects.filter(id=media.id).aupdate(file_path=None, size=0)
+        return None
+
+    await MediaCache.objects.filter(id=media.id).aupdate(used_at=now())
+    return media.file_path
+
+
+async def cache_file(document, file_path: str | None, limit: int = settings.TELEGRAM_MEDIA_CACHE_SIZE):
+    if not file_path or not Path(file_path).exists():
+        # a row without a file would take no part in eviction
+        logging.warning(f'Not caching document {document.id}, its file {file_path} is missing')
+        return
+
+    await MediaCache.objects.aupdate_or_create(
+        document_id=document.id,
+        defaults={'file_path': file_path, 'size': document.size, 'used_at': now()},
+    )
+    await evict_files(limit)
+
+
+async def evict_files(limit: int = settings.TELEGRAM_MEDIA_CACHE_SIZE):
+    """Deletes least recently used files until the cached files fit into the limit"""
+    cached = MediaCache.objects.filter(file_path__isnull=False)
+    total = (await cached.aaggregate(total=Sum('size')))['total'] or 0
+
+    async for media in cached.order_by('used_at'):
+        if total <= limit:
+            break
+        try:
+            Path(media.file_path).unlink(missing_ok=True)
+        except OSError as e:
+            logging.warning(f'Failed to evict cached media {media.file_path}: {e}')
+            continue
+        await MediaCache.objects.filter(id=media.id).aupdate(file_path=None, size=0)
+        total -= media.size
+
+
+async def get_cached_reference(document_id: int, sender_key: str) -> InputDocument | None:
+    """The document as uploaded by the sender, it's sent again without uploading"""
+    reference = await MediaCacheReference.objects.filter(
+        media__document_id=document_id,
+        sender_key=sender_key,
+    ).afirst()
+    if not reference:
+        return None
+
+    await MediaCache.objects.filter(document_id=document_id).aupdate(used_at=now())
+    return InputDocument(reference.document_id, reference.access_hash, bytes(reference.file_reference))
+
+
+async def cache_reference(document_id: int, sender_key: str, document):
+    media, _ = await MediaCache.objects.aget_or_create(document_id=document_id)
+    await MediaCacheReference.objects.aupdate_or_create(
+        media=media,
+        sender_key=sender_key,
+        defaults={
+            'document_id': document.id,
+            'access_hash': document.access_hash,
+            'file_reference': document.file_reference,
+        },
+    )
+
+
+async def drop_reference(document_id: int, sender_key: str):
+    await MediaCacheReference.objects.filter(media__document_id=document_id, sender_key=sender_key).adelete()
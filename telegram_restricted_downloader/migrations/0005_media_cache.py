@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_restricted_downloader', '0004_account_username'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_id', models.BigIntegerField(unique=True, verbose_name='Document ID')),
+                ('file_path', models.CharField(max_length=1024, null=True, verbose_name='File Path')),
+                ('size', models.BigIntegerField(default=0, verbose_name='Size')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('used_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Used At')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaCacheReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sender_key', models.CharField(max_length=255, verbose_name='Sender Key')),
+                ('document_id', models.BigIntegerField(verbose_name='Document ID')),
+                ('access_hash', models.BigIntegerField(verbose_name='Access Hash')),
+                ('file_reference', models.BinaryField(verbose_name='File Reference')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('media', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='telegram_restricted_downloader.mediacache', verbose_name='Media')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('media', 'sender_key'), name='unique_media_cache_reference')],
+            },
+        ),
+    ]
@@ -84,3 +84,78 @@ class Account(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class MediaCache(models.Model):
+    """Downloaded document of a source channel, the local file is evicted first when the cache is full"""
+
+    document_id = models.BigIntegerField(
+        unique=True,
+        verbose_name=_('Document ID'),
+    )
+
+    file_path = models.CharField(
+        null=True,
+        max_length=1024,
+        verbose_name=_('File Path'),
+    )
+
+    size = models.BigIntegerField(
+        default=0,
+        verbose_name=_('Size'),
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Created At'),
+    )
+
+    used_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name=_('Used At'),
+    )
+
+    def __str__(self):
+        return str(self.document_id)
+
+
+class MediaCacheReference(models.Model):
+    """Document uploaded by a sender, it can be sent again by reference without uploading"""
+
+    media = models.ForeignKey(
+        MediaCache,
+        related_name='references',
+        on_delete=models.CASCADE,
+        verbose_name=_('Media'),
+    )
+
+    sender_key = models.CharField(
+        max_length=255,
+        verbose_name=_('Sender Key'),
+    )
+
+    document_id = models.BigIntegerField(
+        verbose_name=_('Document ID'),
+    )
+
+    access_hash = models.BigIntegerField(
+        verbose_name=_('Access Hash'),
+    )
+
+    file_reference = models.BinaryField(
+        verbose_name=_('File Reference'),
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name=_('Created At'),
+    )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=('media', 'sender_key'), name='unique_media_cache_reference'),
+        )
+
+    def __str__(self):
+        return f'{self.media} ({self.sender_key})'
@@ -0,0 +1,173 @@
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from asgiref.sync import sync_to_async
+from django.db import connections
+from telethon.tl.types import Document
+
+from telegram_restricted_downloader.media_cache import cache_file
+from telegram_restricted_downloader.models import Account, MediaCache
+from telegram_restricted_downloader.transfers import ParallelDownloader
+from telegram_restricted_downloader.workflows.restricted_downloader import RestrictedDownloaderWorkflow
+from users.models import User
+from workflows.constants import JOB_FAILED, JOB_PLANNED, JOB_SUCCESS
+from workflows.manager import async_manager
+
+
+class FakeClient:
+    def __init__(self):
+        self.downloads = []
+
+    async def download_file(self, document, file, progress_callback=None):
+        # like Telethon, a download to a path returns nothing
+        Path(file).parent.mkdir(parents=True, exist_ok=True)
+        Path(file).write_bytes(b'data')
+        self.downloads.append(file)
+
+
+class FakeSource(FakeClient):
+    def __init__(self, messages: list):
+        super().__init__()
+        self.messages = messages
+
+    async def get_messages(self, channel, ids):
+        return self.messages
+
+
+class FakeSender:
+    def __init__(self):
+        self.sent = []
+
+    async def get_entity(self, entity):
+        return entity
+
+    async def send_file(self, entity, files, **kwargs):
+        self.sent.append(files)
+        return [SimpleNamespace(id=100 + index, document=None) for index in range(len(files))]
+
+
+def make_document(size: int, document_id: int = 1) -> Document:
+    return Document(
+        id=document_id,
+        access_hash=2,
+        file_reference=b'',
+        date=None,
+        mime_type='video/mp4',
+        size=size,
+        dc_id=2,
+        attributes=[],
+    )
+
+
+def test_small_file_download_returns_path(tmp_path):
+    client = FakeClient()
+    file_path = str(tmp_path / '1.mp4')
+
+    result = asyncio.run(ParallelDownloader(client, make_document(1024), file_path).download())
+
+    assert result == file_path
+    assert client.downloads == [file_path]
+    assert Path(result).read_bytes() == b'data'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_album_keeps_small_documents(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    user = User.objects.create(username='owner')
+    account = Account.objects.create(name='source', phone='1', user=user)
+    workflow = RestrictedDownloaderWorkflow()
+    source = FakeSource([
+        SimpleNamespace(document=make_document(1024, 1), photo=None, message='first', entities=None),
+        None,
+        SimpleNamespace(document=make_document(2048, 2), photo=None, message='second', entities=None),
+    ])
+    sender = FakeSender()
+
+    async def get_client(account=None, bot_token=None):
+        return source if account else sender
+
+    async def get_channel(client, channel_id):
+        return channel_id
+
+    monkeypatch.setattr(workflow, 'get_client', get_client)
+    monkeypatch.setattr(workflow, 'get_channel', get_channel)
+
+    async def run():
+        process, _ = await async_manager.create_process(
+            None,
+            RestrictedDownloaderWorkflow,
+            stage_data={'from_account_id': account.id, 'destination_user_id': 1},
+        )
+        job = await workflow.create_job(
+            process=process, stage='send_album', data={'channel_id': 1, 'message_ids': [1, 2, 3]},
+        )
+        await workflow.send_album(process, job)
+        await job.arefresh_from_db()
+        # the connection of the sync_to_async thread would keep the test database open
+        await sync_to_async(connections.close_all)()
+        return job
+
+    job = asyncio.run(run())
+
+    assert sender.sent == [['downloads/1.mp4', 'downloads/2.mp4']]
+    assert job.status == JOB_SUCCESS
+    assert not (tmp_path / 'downloads' / '1.mp4').exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cache_file_needs_the_file(tmp_path):
+    file_path = tmp_path / '1.mp4'
+    file_path.write_bytes(b'data')
+
+    async def run():
+        await cache_file(make_document(4, 1), None, limit=1024)
+        await cache_file(make_document(4, 2), str(tmp_path / 'missing.mp4'), limit=1024)
+        await cache_file(make_document(4, 3), str(file_path), limit=1024)
+        await sync_to_async(connections.close_all)()
+
+    asyncio.run(run())
+
+    assert list(MediaCache.objects.values_list('document_id', 'file_path')) == [(3, str(file_path))]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_album_fails_planned_children(monkeypatch):
+    user = User.objects.create(username='owner')
+    account = Account.objects.create(name='source', phone='1', user=user)
+    workflow = RestrictedDownloaderWorkflow()
+    source = FakeSource([None])
+
+    async def get_client(account=None, bot_token=None):
+        return source if account else FakeSender()
+
+    async def get_channel(client, channel_id):
+        return channel_id
+
+    monkeypatch.setattr(workflow, 'get_client', get_client)
+    monkeypatch.setattr(workflow, 'get_channel', get_channel)
+
+    async def run():
+        process, _ = await async_manager.create_process(
+            None,
+            RestrictedDownloaderWorkflow,
+            stage_data={'from_account_id': account.id, 'destination_user_id': 1},
+        )
+        job = await workflow.create_job(
+            process=process, stage='send_album', data={'channel_id': 1, 'message_ids': [1]},
+        )
+        child = await workflow.create_job(
+            process=process, stage='send_album', data={'channel_id': 1, 'message_ids': [2]},
+            parents=[job], status=JOB_PLANNED,
+        )
+        await workflow.send_album(process, job)
+        await job.arefresh_from_db()
+        await child.arefresh_from_db()
+        await sync_to_async(connections.close_all)()
+        return job, child
+
+    job, child = asyncio.run(run())
+
+    assert job.status == JOB_FAILED
+    assert child.status == JOB_FAILED
@@ -0,0 +1,353 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+from collections.abc import Awaitable, Callable
+from math import ceil
+from pathlib import Path
+
+from django.conf import settings
+from telethon import TelegramClient, utils
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import DocumentAttributeFilename, InputFile, InputFileBig
+
+# offsets of file parts must be divisible by 4 KiB and 1 MiB by the part size
+PART_SIZE = 512 * 1024
+# smaller files are not worth extra connections
+PARALLEL_MIN_SIZE = 10 * 1024 * 1024
+BITMAP_SUFFIX = '.parts'
+# parts a relay holds in memory besides the ones being uploaded
+RELAY_BUFFER_PARTS = 8
+
+ProgressCallback = Callable[[int, int], Awaitable | None]
+
+
+async def report_progress(progress_callback: ProgressCallback | None, current: int, total: int):
+    if progress_callback:
+        reported = progress_callback(current, total)
+        if asyncio.iscoroutine(reported):
+            await reported
+
+
+def dump_input_file(input_file: InputFile | InputFileBig) -> dict:
+    """JSON of an uploaded file handle, so a retried job sends it without uploading again"""
+    data = {
+        'id': input_file.id,
+        'parts': input_file.parts,
+        'name': input_file.name,
+    }
+    if isinstance(input_file, InputFile):
+        data['md5_checksum'] = input_file.md5_checksum
+    return data
+
+
+def load_input_file(data: dict) -> InputFile | InputFileBig:
+    if 'md5_checksum' in data:
+        return InputFile(data['id'], data['parts'], data['name'], data['md5_checksum'])
+    return InputFileBig(data['id'], data['parts'], data['name'])
+
+
+class SenderPool:
+    """
+    Extra MTProto connections of a client to one data center.
+    Connections to a foreign data center share one authorization exported by the first of them
+    """
+
+    def __init__(self, client: TelegramClient, dc_id: int):
+        self.client = client
+        self.dc_id = dc_id
+        self.auth_key = client.session.auth_key if dc_id == client.session.dc_id else None
+        self.senders = []
+
+    async def create_sender(self) -> MTProtoSender:
+        # Telethon has no public API for extra connections, they are built like its own exported senders
+        dc = await self.client._get_dc(self.dc_id)  # noqa: SLF001
+        sender = MTProtoSender(self.auth_key, loggers=self.client._log)  # noqa: SLF001
+        await sender.connect(self.client._connection(  # noqa: SLF001
+            dc.ip_address,
+            dc.port,
+            dc.id,
+            loggers=self.client._log,  # noqa: SLF001
+            proxy=self.client._proxy,  # noqa: SLF001
+            local_addr=self.client._local_addr,  # noqa: SLF001
+        ))
+        self.senders.append(sender)
+
+        if not self.auth_key:
+            auth = await self.client(ExportAuthorizationRequest(self.dc_id))
+            init_request = self.client._init_request  # noqa: SLF001
+            init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(InvokeWithLayerRequest(LAYER, init_request))
+            self.auth_key = sender.auth_key
+
+        return sender
+
+    async def close(self):
+        await asyncio.gather(*(sender.disconnect() for sender in self.senders), return_exceptions=True)
+        self.senders = []
+
+
+class PartsBitmap:
+    """
+    Sidecar file of completed parts, one bit per part.
+    Bits are written after their part, so a crashed transfer only repeats parts it had in flight
+    """
+
+    def __init__(self, path: Path, parts: int):
+        self.path = path
+        self.parts = parts
+        self.bits = bytearray(ceil(parts / 8))
+        self.fd = None
+
+    def open(self, resume: bool):
+        if resume and self.path.exists() and self.path.stat().st_size == len(self.bits):
+            self.bits = bytearray(self.path.read_bytes())
+        else:
+            self.path.write_bytes(self.bits)
+        self.fd = os.open(self.path, os.O_WRONLY)
+
+    def is_done(self, index: int) -> bool:
+        return bool(self.bits[index // 8] & (1 << index % 8))
+
+    def mark_done(self, index: int):
+        self.bits[index // 8] |= 1 << index % 8
+        os.pwrite(self.fd, self.bits[index // 8:index // 8 + 1], index // 8)
+
+    def missing(self) -> list[int]:
+        return [index for index in range(self.parts) if not self.is_done(index)]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def remove(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+class ParallelDownloader:
+    """
+    Downloads a document by parts over several connections at once.
+    Parts are written at their offsets into a preallocated file, so a debounced or crashed job resumes
+    from the parts left in the sidecar bitmap
+    """
+
+    def __init__(
+            self,
+            client: TelegramClient,
+            document,
+            file_path: str,
+            connections: int = settings.TELEGRAM_TRANSFER_CONNECTIONS,
+            part_size: int = PART_SIZE,
+            progress_callback: ProgressCallback = None,
+    ):
+        self.client = client
+        self.document = document
+        self.path = Path(file_path)
+        self.connections = connections
+        self.part_size = part_size
+        self.progress_callback = progress_callback
+
+        self.size = document.size
+        self.parts = ceil(self.size / part_size)
+        self.dc_id, self.location = utils.get_input_location(document)
+        self.bitmap = PartsBitmap(self.path.with_name(self.path.name + BITMAP_SUFFIX), self.parts)
+        self.downloaded = 0
+        self.fd = None
+
+    async def download(self) -> str:
+        if self.size < PARALLEL_MIN_SIZE or self.connections < 2:
+            # returns nothing when it writes to a path
+            await self.client.download_file(self.document, str(self.path), progress_callback=self.progress_callback)
+            return str(self.path)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        resume = self.path.exists() and self.path.stat().st_size == self.size
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        try:
+            if not resume:
+                os.ftruncate(self.fd, self.size)
+            self.bitmap.open(resume)
+
+            queue = self.bitmap.missing()
+            self.downloaded = (self.parts - len(queue)) * self.part_size
+            if queue:
+                logging.info(f'Downloading {len(queue)}/{self.parts} parts of {self.path}')
+                await self.download_parts(queue)
+        finally:
+            self.bitmap.close()
+            os.close(self.fd)
+
+        self.bitmap.remove()
+        return str(self.path)
+
+    async def download_parts(self, queue: list[int]):
+        pool = SenderPool(self.client, self.dc_id)
+        try:
+            # the first connection exports the authorization for the others
+            senders = [await pool.create_sender()]
+            senders += await asyncio.gather(
+                *(pool.create_sender() for _ in range(min(self.connections, len(queue)) - 1)),
+            )
+
+            queue.reverse()
+            tasks = [asyncio.create_task(self.download_worker(sender, queue)) for sender in senders]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        finally:
+            await pool.close()
+
+    async def download_worker(self, sender: MTProtoSender, queue: list[int]):
+        while queue:
+            index = queue.pop()
+            offset = index * self.part_size
+            result = await sender.send(GetFileRequest(self.location, offset=offset, limit=self.part_size))
+
+            os.pwrite(self.fd, result.bytes, offset)
+            self.bitmap.mark_done(index)
+
+            self.downloaded = min(self.downloaded + self.part_size, self.size)
+            await report_progress(self.progress_callback, self.downloaded, self.size)
+
+
+class ParallelUploader:
+    """
+    Uploads a file by parts over several connections to the home data center of the client at once.
+    Returns the InputFile handle of the upload, it can be sent several times while Telegram keeps the parts
+    """
+
+    def __init__(
+            self,
+            client: TelegramClient,
+            file_path: str,
+            connections: int = settings.TELEGRAM_TRANSFER_CONNECTIONS,
+            part_size: int = PART_SIZE,
+            progress_callback: ProgressCallback = None,
+    ):
+        self.client = client
+        self.path = Path(file_path)
+        self.connections = connections
+        self.part_size = part_size
+        self.progress_callback = progress_callback
+
+        self.size = self.path.stat().st_size
+        self.parts = ceil(self.size / part_size)
+        self.file_id = random.getrandbits(63)  # noqa: S311
+        self.uploaded = 0
+        self.fd = None
+
+    async def upload(self) -> InputFile | InputFileBig:
+        if self.size < PARALLEL_MIN_SIZE or self.connections < 2:
+            return await self.client.upload_file(str(self.path), progress_callback=self.progress_callback)
+
+        queue = list(reversed(range(self.parts)))
+        pool = SenderPool(self.client, self.client.session.dc_id)
+        self.fd = os.open(self.path, os.O_RDONLY)
+        try:
+            senders = await asyncio.gather(*(pool.create_sender() for _ in range(min(self.connections, self.parts))))
+            tasks = [asyncio.create_task(self.upload_worker(sender, queue)) for sender in senders]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        finally:
+            os.close(self.fd)
+            await pool.close()
+
+        return InputFileBig(self.file_id, self.parts, self.path.name)
+
+    async def upload_worker(self, sender: MTProtoSender, queue: list[int]):
+        while queue:
+            index = queue.pop()
+            part = os.pread(self.fd, self.part_size, index * self.part_size)
+            await sender.send(SaveBigFilePartRequest(self.file_id, index, self.parts, part))
+
+            self.uploaded = min(self.uploaded + self.part_size, self.size)
+            await report_progress(self.progress_callback, self.uploaded, self.size)
+
+
+class MediaRelay:
+    """
+    Streams a document from the source client into an upload of the sender client without touching the disk.
+    Downloaded parts wait in a bounded queue, so memory holds at most buffer parts and one part per connection
+    """
+
+    def __init__(
+            self,
+            source: TelegramClient,
+            sender: TelegramClient,
+            document,
+            connections: int = settings.TELEGRAM_TRANSFER_CONNECTIONS,
+            buffer: int = RELAY_BUFFER_PARTS,
+            part_size: int = PART_SIZE,
+            progress_callback: ProgressCallback = None,
+    ):
+        self.source = source
+        self.sender = sender
+        self.document = document
+        self.connections = max(connections, 1)
+        self.part_size = part_size
+        self.progress_callback = progress_callback
+
+        self.size = document.size
+        self.parts = ceil(self.size / part_size)
+        self.big = self.size >= PARALLEL_MIN_SIZE
+        self.file_id = random.getrandbits(63)  # noqa: S311
+        names = [attribute.file_name for attribute in document.attributes
+                 if isinstance(attribute, DocumentAttributeFilename)]
+        self.name = names[0] if names else f'{document.id}{utils.get_extension(document)}'
+        self.md5 = hashlib.md5()  # noqa: S324
+        self.queue = asyncio.Queue(maxsize=buffer)
+        self.uploaded = 0
+
+    async def relay(self) -> InputFile | InputFileBig:
+        pool = SenderPool(self.sender, self.sender.session.dc_id)
+        try:
+            senders = await asyncio.gather(*(pool.create_sender() for _ in range(min(self.connections, self.parts))))
+            tasks = [asyncio.create_task(self.upload_worker(sender)) for sender in senders]
+            tasks.append(asyncio.create_task(self.download(len(senders))))
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        finally:
+            await pool.close()
+
+        if self.big:
+            return InputFileBig(self.file_id, self.parts, self.name)
+        return InputFile(self.file_id, self.parts, self.name, self.md5.hexdigest())
+
+    async def download(self, workers: int):
+        index = 0
+        async for chunk in self.source.iter_download(
+                self.document, chunk_size=self.part_size, request_size=self.part_size, file_size=self.size,
+        ):
+            if not self.big:
+                self.md5.update(chunk)
+            await self.queue.put((index, chunk))
+            index += 1
+
+        for _ in range(workers):
+            await self.queue.put(None)
+
+    async def upload_worker(self, sender: MTProtoSender):
+        while item := await self.queue.get():
+            index, part = item
+            if self.big:
+                await sender.send(SaveBigFilePartRequest(self.file_id, index, self.parts, part))
+            else:
+                await sender.send(SaveFilePartRequest(self.file_id, index, part))
+
+            self.uploaded = min(self.uploaded + self.part_size, self.size)
+            await report_progress(self.progress_callback, self.uploaded, self.size)
@@ -1,51 +1,106 @@
+import asyncio
 from pathlib import Path
 
 from django.conf import settings
-from telethon import TelegramClient
-from telethon.errors import AuthKeyUnregisteredError
-from telethon.sessions import MemorySession, StringSession
+from telethon.errors import (
+    AuthKeyUnregisteredError,
+    FilePartMissingError,
+    FilePartsInvalidError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    FloodWaitError,
+    MediaEmptyError,
+)
 from telethon.tl.types import DocumentAttributeAudio, DocumentAttributeVideo, MessageActionTopicCreate
 
 from telegram_bot.services.restricted_downloader import fetch_channel_info, get_message_text, get_topic_text
-from telegram_restricted_downloader.helpers import ProgressTracker
+from telegram_restricted_downloader.clients import client_pool
+from telegram_restricted_downloader.helpers import TTLCache
+from telegram_restricted_downloader.media_cache import (
+    cache_file,
+    cache_reference,
+    drop_reference,
+    get_cached_file,
+    get_cached_reference,
+)
 from telegram_restricted_downloader.models import Account
-from workflows.constants import JOB_PLANNED
+from telegram_restricted_downloader.transfers import (
+    MediaRelay,
+    ParallelDownloader,
+    ParallelUploader,
+    dump_input_file,
+    load_input_file,
+)
+from workflows.constants import JOB_ACTIVE, JOB_PLANNED
 from workflows.models import Job, Process
+from workflows.payload import PayloadSchema
+from workflows.rate_limit import RateLimit
+from workflows.retry import RetryPolicy
 from workflows.workflow import AsyncWorkflow
 
+# flood waits are expected on big channels, they are waited out instead of failing the job
+FLOOD_WAIT_RETRY_POLICY = RetryPolicy(max_attempts=50, retry_on=(FloodWaitError,))
+TRANSFER_RETRY_POLICY = RetryPolicy(max_attempts=5, base_delay=30)
+# messages fetched at once for the next jobs of a process, file references of cached ones stay fresh for hours
+PREFETCH_MESSAGES = 50
+MESSAGE_CACHE_SIZE = 1000
+MESSAGE_CACHE_TTL = 30 * 60
+# channel ids given as usernames stay in the JSON data
+MESSAGE_PAYLOAD = PayloadSchema(channel_id='int', chapter_id='int', message_id='int')
+
+
+def get_sender_key(process: Process) -> str:
+    return str(process.data.get('sender_account_id') or 'bot')
+
+
+# messages of one sender account, or of the bot, across all processes
+SENDER_RATE_LIMIT = RateLimit(
+    limit=20,
+    period=60,
+    burst=3,
+    name='telegram_sender',
+    key=lambda process, job: get_sender_key(process),
+)
+
 
 class RestrictedDownloaderWorkflow(AsyncWorkflow):
+    stage_concurrency = {
+        'download_media': 4,
+        'send_message': 1,
+        'send_album': 1,
+    }
+
+    retry_policies = {
+        'download_media': (FLOOD_WAIT_RETRY_POLICY, TRANSFER_RETRY_POLICY),
+        'send_message': (FLOOD_WAIT_RETRY_POLICY, TRANSFER_RETRY_POLICY),
+        'send_album': (FLOOD_WAIT_RETRY_POLICY, TRANSFER_RETRY_POLICY),
+    }
+
+    rate_limits = {
+        'send_message': SENDER_RATE_LIMIT,
+        'send_album': SENDER_RATE_LIMIT,
+    }
+
+    payload_schemas = {
+        'download_media': MESSAGE_PAYLOAD,
+        'send_message': MESSAGE_PAYLOAD,
+        'send_album': MESSAGE_PAYLOAD,
+    }
+
     def __init__(self):
         super().__init__()
-        self.clients = dict()
         self.channels = dict()
-        self.messages = dict()
+        self.messages = TTLCache(MESSAGE_CACHE_SIZE, MESSAGE_CACHE_TTL)
         self.chapters = dict()
 
-    async def get_client(
-            self,
-            account: Account = None,
-            bot_token: str = settings.TELEGRAM_BOT_TOKEN,
-            key: str = 'client',
-    ):
-        if not self.clients.get(key):
-            if account:
-                self.clients[key] = TelegramClient(
-                    StringSession(
-                        account.session_string,
-                    ), settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH,
-                )
-            elif bot_token:
-                self.clients[key] = TelegramClient(
-                    MemorySession(), settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH,
-                )
+    async def get_client(self, account: Account = None, bot_token: str = settings.TELEGRAM_BOT_TOKEN):
+        """Warm client of the account, or of the bot, shared by all jobs of this worker"""
+        return await client_pool.get(account, bot_token)
 
-        if account:
-            await self.clients[key].connect()
-        elif bot_token:
-            await self.clients[key].start(bot_token=bot_token)
-
-        return self.clients[key]
+    async def fail_with_reason(self, job: Job, reason: str):
+        # the second argument of fail_job is disable_triggers, the reason goes to the job log
+        await self.job_log(job, reason)
+        await self.fail_job(job)
 
     async def get_channel(self, client, channel_id: int):
         channel_id = int(channel_id)
@@ -62,13 +117,42 @@ class RestrictedDownloaderWorkflow(AsyncWorkflow):
                 (await client.get_messages(await self.get_channel(client, channel_id), ids=[chapter_id]))[0]
         return self.chapters[chapter_id]
 
-    async def get_message(self, client, channel_id: int, message_id: int):
+    async def get_message(self, client, channel_id: int, message_id: int, job: Job = None):
+        """
+        Message of the channel, a cache miss of a job also fetches the messages of the next jobs
+        of its process in the same request
+        """
         channel_id = int(channel_id)
         message_id = int(message_id)
-        if not self.messages.get(message_id):
-            self.messages[message_id] = \
-                (await client.get_messages(await self.get_channel(client, channel_id), ids=[message_id]))[0]
-        return self.messages[message_id]
+        if message_id not in self.messages:
+            ids = await self.get_prefetch_ids(job, channel_id, message_id) if job else [message_id]
+            messages = await client.get_messages(await self.get_channel(client, channel_id), ids=ids)
+            for fetched_id, message in zip(ids, messages, strict=True):
+                self.messages[fetched_id] = message
+            return messages[0]
+        return self.messages.get(message_id)
+
+    async def get_prefetch_ids(self, job: Job, channel_id: int, message_id: int) -> list[int]:
+        """The message id and up to PREFETCH_MESSAGES ids of the next pending jobs that aren't cached"""
+        ids = [message_id]
+        jobs = Job.objects.filter(
+            process_id=job.process_id,
+            stage__in=('download_media', 'send_message'),
+            status__in=(JOB_ACTIVE, JOB_PLANNED),
+            id__gt=job.id,
+        ).order_by('id')[:PREFETCH_MESSAGES * 2]
+
+        async for next_job in jobs:
+            data = self.load_job_data(next_job).data
+            if 'message_id' not in data or str(data.get('channel_id')) != str(channel_id):
+                continue
+            next_id = int(data['message_id'])
+            if next_id not in ids and next_id not in self.messages:
+                ids.append(next_id)
+            if len(ids) >= PREFETCH_MESSAGES:
+                break
+
+        return ids
 
     async def prepare(self, process: Process, job: Job):
         """
@@ -107,7 +191,7 @@ class RestrictedDownloaderWorkflow(AsyncWorkflow):
                 sender_account = None
 
         try:
-            sender = await self.get_client(sender_account, key='sender')
+            sender = await self.get_client(sender_account)
 
             me = await sender.get_me()
         except Exception as e:
@@ -148,133 +232,138 @@ class RestrictedDownloaderWorkflow(AsyncWorkflow):
             else:
                 await self.job_log(job, f'Message {message.id} is a message: {get_message_text(message)}')
                 messages.append(message)
-        last_job = job
+        relay = self.is_relay(process)
+        jobs = []
         for chapter in chapters:
             self.chapters[int(chapter.id)] = chapter
             async for message in client.iter_messages(channel, reply_to=chapter.id, reverse=True):
-                parents = [job]
-                if last_job != job:
-                    parents.append(last_job)
-
-                data = {
+                self.plan_message_jobs(jobs, job, message, {
                     'channel_id': channel_id,
                     'chapter_id': chapter.id,
                     'message_id': message.id,
-                }
-                if message.document:
-                    last_job = await self.create_job(
-                        stage='download_media',
-                        process=process,
-                        parents=parents,
-                        data=data,
-                        status=JOB_PLANNED,
-                    )
-                    parents.append(last_job)
-                last_job = await self.create_job(
-                    stage='send_message',
-                    process=process,
-                    parents=parents,
-                    data=data,
-                    status=JOB_PLANNED,
-                )
+                }, relay)
 
                 self.messages[int(message.id)] = message
 
         for message in messages:
             self.messages[int(message.id)] = message
-            parents = [job]
-            if last_job != job:
-                parents.append(last_job)
-
-            data = {
+            self.plan_message_jobs(jobs, job, message, {
                 'channel_id': channel_id,
                 'message_id': message.id,
-            }
-            if message.document:
-                last_job = await self.create_job(
-                    stage='download_media',
-                    process=process,
-                    parents=parents,
-                    data=data,
-                    status=JOB_PLANNED,
-                )
-                parents.append(last_job)
-            last_job = await self.create_job(
-                stage='send_message',
-                process=process,
-                parents=parents,
-                data=data,
-                status=JOB_PLANNED,
-            )
+            }, relay)
 
         if not job.data.get('chapter_ids', []) + job.data.get('message_ids', []):
             async for message in client.iter_messages(channel, reverse=True):
-                parents = [job]
-                if last_job != job:
-                    parents.append(last_job)
-
-                data = {
+                self.plan_message_jobs(jobs, job, message, {
                     'channel_id': channel_id,
                     'message_id': message.id,
-                }
-                if message.document:
-                    last_job = await self.create_job(
-                        stage='download_media',
-                        process=process,
-                        parents=parents,
-                        data=data,
-                        status=JOB_PLANNED,
-                    )
-                    parents.append(last_job)
-                last_job = await self.create_job(
-                    stage='send_message',
-                    process=process,
-                    parents=parents,
-                    data=data,
-                    status=JOB_PLANNED,
-                )
+                }, relay)
 
                 self.messages[int(message.id)] = message
 
+        await self.create_jobs_bulk(process, jobs)
+
         # finish prepare job, this will activate next jobs
         await self.done_job(job)
 
-    async def progress_callback(self, job, current=0, total=0):
-        if not total:
-            total = 0
-        stats = ProgressTracker().callback(current, total)
-        await self.update_job_data(job, {'progress': stats})
+    def is_relay(self, process: Process) -> bool:
+        return process.data.get('relay_media', settings.TELEGRAM_RELAY_MEDIA)
+
+    def plan_message_jobs(self, jobs: list[dict], job: Job, message, data: dict, relay: bool = False):
+        """
+        Appends download and send jobs of the message to the plan,
+        each message waits for the previous one to keep the channel order.
+        Relayed documents are streamed by send_message, they have no download job.
+        Members of an album are collected into one send_album job
+        """
+        if message.grouped_id:
+            album = jobs[-1] if jobs else None
+            if album and album['stage'] == 'send_album' and album['data']['grouped_id'] == message.grouped_id:
+                album['data']['message_ids'].append(message.id)
+                return
+
+        parents = [job]
+        if jobs:
+            parents.append(jobs[-1]['key'])
+
+        if message.grouped_id:
+            jobs.append({
+                'key': len(jobs),
+                'stage': 'send_album',
+                'parents': parents,
+                'data': {**data, 'grouped_id': message.grouped_id, 'message_ids': [message.id]},
+                'status': JOB_PLANNED,
+            })
+            return
+
+        if message.document and not relay:
+            jobs.append({
+                'key': len(jobs),
+                'stage': 'download_media',
+                'parents': [*parents],
+                'data': data,
+                'status': JOB_PLANNED,
+            })
+            parents.append(jobs[-1]['key'])
+        elif message.document:
+            data = {**data, 'relay': True}
+
+        jobs.append({
+            'key': len(jobs),
+            'stage': 'send_message',
+            'parents': parents,
+            'data': data,
+            'status': JOB_PLANNED,
+        })
 
     async def download_media(self, process: Process, job: Job):
         client = await self.get_client(await Account.objects.aget(id=process.data['from_account_id']))
 
         try:
-            message = await self.get_message(client, job.data['channel_id'], job.data['message_id'])
+            message = await self.get_message(client, job.data['channel_id'], job.data['message_id'], job)
         except AuthKeyUnregisteredError:
-            return await self.fail_job(job, 'Source client session is invalid.')
+            return await self.fail_with_reason(job, 'Source client session is invalid.')
         except Exception as e:
             if 'Could not find the input entity' in str(e):
-                return await self.fail_job(
+                return await self.fail_with_reason(
                     job, 'Channel not found.' if 'PeerChannel' in str(e) else 'Message not found.',
                 )
             elif 'The key is not registered in the system' in str(e):
-                return await self.fail_job(job, 'Source client session is invalid.')
+                return await self.fail_with_reason(job, 'Source client session is invalid.')
             raise
         if not message.document:
-            return await self.fail_job(job, 'Message has no document.')
+            return await self.fail_with_reason(job, 'Message has no document.')
 
-        extension = ''
-        if message.document.mime_type and len(message.document.mime_type.split('/')) > 1:
-            extension = '.' + message.document.mime_type.split('/')[1]
-        file_path = f'./downloads/{message.document.id}' + extension
-
-        file = await client.download_file(
-            message.document, file_path,
-            progress_callback=lambda current, total: self.progress_callback(job, current, total),
-        )
+        file_path = self.get_document_path(message.document)
+
+        if await get_cached_reference(message.document.id, get_sender_key(process)):
+            await self.job_log(job, 'Document was already uploaded by the sender, it is sent by reference')
+            return await self.done_job(job)
+        cached_file = await get_cached_file(message.document)
+        if cached_file:
+            await self.job_log(job, f'File is cached: {cached_file}')
+            return await self.done_job(job)
+
+        progress = self.get_progress_reporter(job)
+        downloader = ParallelDownloader(client, message.document, file_path, progress_callback=progress.aupdate)
+        try:
+            file = await downloader.download()
+        except FileReferenceExpiredError:
+            # the retry fetches the message again, completed parts are kept
+            self.messages.pop(int(job.data['message_id']), None)
+            raise
+        await progress.afinish()
+        if settings.TELEGRAM_MEDIA_CACHE_SIZE:
+            await cache_file(message.document, file)
         await self.job_log(job, f'File downloaded: {file}')
         await self.done_job(job)
 
+    def get_document_path(self, document) -> str:
+        extension = ''
+        if document.mime_type and len(document.mime_type.split('/')) > 1:
+            extension = '.' + document.mime_type.split('/')[1]
+        return f'./downloads/{document.id}' + extension
+
     def detect_document_kwargs(self, document):
         kwargs = {}
         if document.mime_type and len(document.mime_type.split('/')) > 1 and document.attributes:
@@ -294,73 +383,150 @@ class RestrictedDownloaderWorkflow(AsyncWorkflow):
 
         return kwargs
 
-    async def send_message(self, process: Process, job: Job):
-        client = await self.get_client(await Account.objects.aget(id=process.data['from_account_id']))
-        sender_account = None
+    async def send_document(
+            self,
+            job: Job,
+            client,
+            sender,
+            destination_user,
+            message,
+            file_path: str | None,
+            text: str,
+            sender_key: str,
+    ) -> int:
+        """
+        Uploads the downloaded document in parallel parts, or relays it from the client without a file,
+        and sends it, returns the id of the sent message.
+        The uploaded file is kept in the job data, so a retry sends it again without uploading,
+        and the sent document is cached, so later processes of the sender send it by reference
+        """
+        kwargs = {
+            'caption': text[:1024],
+            'formatting_entities': message.entities,
+            **self.detect_document_kwargs(message.document),
+        }
+
+        reference = await get_cached_reference(message.document.id, sender_key)
+        if reference:
+            try:
+                sent_message = await sender.send_file(destination_user, reference, **kwargs)
+            except (FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError):
+                await drop_reference(message.document.id, sender_key)
+                await self.job_log(job, 'Cached document reference is stale, uploading it again')
+            else:
+                return sent_message.id
+
+        if file_path and not Path(file_path).exists():
+            # the download was skipped for the reference or the file was evicted
+            file_path = None
+
+        if job.data.get('uploaded_file'):
+            input_file = load_input_file(job.data['uploaded_file'])
+        else:
+            progress = self.get_progress_reporter(job)
+            if file_path:
+                input_file = await ParallelUploader(sender, file_path, progress_callback=progress.aupdate).upload()
+            else:
+                relay = MediaRelay(client, sender, message.document, progress_callback=progress.aupdate)
+                try:
+                    input_file = await relay.relay()
+                except FileReferenceExpiredError:
+                    self.messages.pop(int(job.data['message_id']), None)
+                    raise
+            await progress.afinish()
+            await self.update_job_data(job, {'uploaded_file': dump_input_file(input_file)})
+
+        try:
+            # attributes can't be detected from an uploaded file, the original ones are reused
+            sent_message = await sender.send_file(
+                destination_user, input_file,
+                mime_type=message.document.mime_type,
+                attributes=message.document.attributes,
+                **kwargs,
+            )
+        except (FilePartMissingError, FilePartsInvalidError):
+            # Telegram dropped the uploaded parts, the retry uploads the file again
+            await self.update_job_data(job, {'uploaded_file': None})
+            raise
+
+        if sent_message.document:
+            await cache_reference(message.document.id, sender_key, sent_message.document)
+        return sent_message.id
+
+    async def get_sender_account(self, process: Process) -> Account | None:
         if process.data.get('sender_account_id'):
             try:
-                sender_account = await Account.objects.aget(id=process.data.get('sender_account_id'))
+                return await Account.objects.aget(id=process.data.get('sender_account_id'))
             except Account.DoesNotExist:
-                sender_account = None
+                return None
+        return None
 
-        sender = await self.get_client(sender_account, key='sender')
+    async def send_message(self, process: Process, job: Job):
+        client = await self.get_client(await Account.objects.aget(id=process.data['from_account_id']))
+        sender = await self.get_client(await self.get_sender_account(process))
         destination_user = await sender.get_entity(process.data.get('destination_user_id'))
 
         try:
             message = await self.get_message(
-                client, job.data['channel_id'], job.data['message_id'],
+                client, job.data['channel_id'], job.data['message_id'], job,
             )
         except AuthKeyUnregisteredError:
-            return await self.fail_job(job, 'Source client session is invalid.')
+            return await self.fail_with_reason(job, 'Source client session is invalid.')
         except Exception as e:
             if 'Could not find the input entity' in str(e):
-                return await self.fail_job(job, 'Channel not found.' if 'PeerChannel' in str(e) else 'Message not found.')
+                return await self.fail_with_reason(
+                    job, 'Channel not found.' if 'PeerChannel' in str(e) else 'Message not found.',
+                )
             elif 'The key is not registered in the system' in str(e):
-                return await self.fail_job(job, 'Source client session is invalid.')
+                return await self.fail_with_reason(job, 'Source client session is invalid.')
             raise
         text = message.message or ''
         if message.action and isinstance(message.action, MessageActionTopicCreate):
             text = message.action.title
 
         try:
-            sent_message = None
+            # a retry continues after the file and text chunks that were already sent
+            sent_message = job.data.get('sent_message_id')
+            text_offset = job.data.get('sent_text_offset', 0)
             file_path = None
             if message.document:
-                extension = ''
-                if message.document.mime_type and len(message.document.mime_type.split('/')) > 1:
-                    extension = '.' + message.document.mime_type.split('/')[1]
-                file_path = f'./downloads/{message.document.id}' + extension
-                sent_message = await sender.send_file(
-                    destination_user, file_path,
-                    progress_callback=lambda current, total: self.progress_callback(job, current, total),
-                    caption=text[:1024],
-                    formatting_entities=message.entities,
-                    **self.detect_document_kwargs(message.document),
-                )
+                if not job.data.get('relay'):
+                    file_path = self.get_document_path(message.document)
+
+                if not sent_message:
+                    sent_message = await self.send_document(
+                        job, client, sender, destination_user, message, file_path, text, get_sender_key(process),
+                    )
+                    await self.update_job_data(job, {'sent_message_id': sent_message})
 
                 text = text[1024:]
 
             text_size = 4096
             if text:
-                for i in range(0, len(text), text_size):
+                for i in range(text_offset, len(text), text_size):
                     m1 = await sender.send_message(
                         destination_user, text[i:i + text_size],
                         formatting_entities=message.entities if i == 0 else None,
                         reply_to=sent_message,
                     )
                     if not sent_message:
-                        sent_message = m1
+                        sent_message = m1.id
+                    await self.update_job_data(job, {
+                        'sent_message_id': sent_message,
+                        'sent_text_offset': i + text_size,
+                    })
 
         except AuthKeyUnregisteredError:
-            return await self.fail_job(job, 'Sender client session is invalid.')
+            return await self.fail_with_reason(job, 'Sender client session is invalid.')
         except Exception as e:
             if 'The key is not registered in the system' in str(e):
-                return await self.fail_job(job, 'Sender client session is invalid.')
+                return await self.fail_with_reason(job, 'Sender client session is invalid.')
             raise
 
         await self.done_job(job)
 
-        if file_path:
+        # cached files are deleted by the cache when it's full
+        if file_path and not settings.TELEGRAM_MEDIA_CACHE_SIZE:
             try:
                 path = Path(file_path)
                 if path.exists():
@@ -369,3 +535,79 @@ class RestrictedDownloaderWorkflow(AsyncWorkflow):
                     raise FileNotFoundError(f'File not found: {file_path}')
             except Exception as e:
                 await self.process_log(process, str(e))
+
+    async def get_album_file(self, client, message, sender_key: str):
+        """Cached reference, cached file or a new download of a member of an album"""
+        if message.document:
+            reference = await get_cached_reference(message.document.id, sender_key)
+            if reference:
+                return reference
+            cached_file = await get_cached_file(message.document)
+            if cached_file:
+                return cached_file
+
+            downloader = ParallelDownloader(client, message.document, self.get_document_path(message.document))
+            file = await downloader.download()
+            if settings.TELEGRAM_MEDIA_CACHE_SIZE:
+                await cache_file(message.document, file)
+            return file
+
+        if message.photo:
+            return await client.download_media(message.photo, f'./downloads/{message.photo.id}.jpg')
+
+        return None
+
+    async def send_album(self, process: Process, job: Job):
+        """
+        Downloads the members of an album concurrently and sends them as one album
+        """
+        if job.data.get('sent_message_id'):
+            return await self.done_job(job)
+
+        client = await self.get_client(await Account.objects.aget(id=process.data['from_account_id']))
+        sender = await self.get_client(await self.get_sender_account(process))
+        destination_user = await sender.get_entity(process.data.get('destination_user_id'))
+        sender_key = get_sender_key(process)
+
+        try:
+            channel = await self.get_channel(client, job.data['channel_id'])
+            messages = await client.get_messages(channel, ids=job.data['message_ids'])
+        except AuthKeyUnregisteredError:
+            return await self.fail_with_reason(job, 'Source client session is invalid.')
+
+        # deleted members come back as None
+        messages = [message for message in messages if message]
+        files = await asyncio.gather(*(self.get_album_file(client, message, sender_key) for message in messages))
+
+        members = [(message, file) for message, file in zip(messages, files, strict=True) if file]
+        if not members:
+            return await self.fail_with_reason(job, 'Album has no media.')
+
+        progress = self.get_progress_reporter(job)
+        try:
+            sent_messages = await sender.send_file(
+                destination_user, [file for _, file in members],
+                caption=[(message.message or '')[:1024] for message, _ in members],
+                formatting_entities=[message.entities or [] for message, _ in members],
+                progress_callback=progress.aupdate,
+            )
+        except (FileReferenceExpiredError, FileReferenceInvalidError, MediaEmptyError):
+            # a cached reference is stale, the retry downloads the members again
+            for message, _ in members:
+                if message.document:
+                    await drop_reference(message.document.id, sender_key)
+            raise
+        except AuthKeyUnregisteredError:
+            return await self.fail_with_reason(job, 'Sender client session is invalid.')
+        await progress.afinish()
+
+        for (message, _), sent_message in zip(members, sent_messages, strict=True):
+            if message.document and sent_message.document:
+                await cache_reference(message.document.id, sender_key, sent_message.document)
+        await self.update_job_data(job, {'sent_message_id': sent_messages[0].id})
+        await self.done_job(job)
+
+        for message, file in members:
+            # photos aren't cached, documents are deleted by the cache when it's full
+            if isinstance(file, str) and (message.photo or not settings.TELEGRAM_MEDIA_CACHE_SIZE):
+                Path(file).unlink(missing_ok=True)
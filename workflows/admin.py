@@ -1,9 +1,16 @@
 from django.contrib import admin
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
 from django.template.defaulttags import now
 
 from workflows import models
-from workflows.constants import JOB_ACTIVE, JOB_SUCCESS, PROCESS_DONE
+from workflows.constants import JOB_ACTIVE, JOB_PLANNED, JOB_SUCCESS, PROCESS_DONE
 from workflows.manager import manager
+from workflows.payload import pack_int
+from workflows.progress import progress_store
+
+# payloads matching a searched id that are unpacked to check it
+PAYLOAD_SEARCH_LIMIT = 1000
 
 
 class JobLogInline(admin.TabularInline):
@@ -123,6 +130,8 @@ class ProcessAdmin(admin.ModelAdmin):
         'workflow_class',
         'config',
         'status',
+        'priority',
+        'progress',
         'done_at',
     )
 
@@ -139,6 +148,10 @@ class ProcessAdmin(admin.ModelAdmin):
         'config',
         'data',
         'done_at',
+        'jobs_pending',
+        'jobs_success',
+        'jobs_failed',
+        'dispatched_at',
     )
 
     inlines = (
@@ -156,10 +169,24 @@ class ProcessAdmin(admin.ModelAdmin):
             process.save()
 
             models.Job.objects.filter(process=process, status=JOB_ACTIVE).update(status=JOB_SUCCESS)
+            process.refresh_job_counters()
+
+    @admin.display(description='Progress')
+    def progress(self, obj):
+        text = f'{obj.jobs_success + obj.jobs_failed}/{obj.jobs_total}'
+        if obj.jobs_failed:
+            text += f' ({obj.jobs_failed} failed)'
+        return text
 
     def has_add_permission(self, request):
         return False
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'priority' in form.changed_data:
+            # waiting jobs follow the new priority of their process
+            models.Job.objects.filter(process=obj, status__in=(JOB_ACTIVE, JOB_PLANNED)).update(priority=obj.priority)
+
 
 @admin.register(models.Job)
 class JobAdmin(admin.ModelAdmin):
@@ -187,7 +214,12 @@ class JobAdmin(admin.ModelAdmin):
         'done_at',
         'process',
         'data',
+        'payload_data',
+        'progress',
         'touched_at',
+        'claimed_by',
+        'claimed_till',
+        'attempts',
     )
 
     inlines = (
@@ -232,5 +264,68 @@ class JobAdmin(admin.ModelAdmin):
 
             workflow.fail_job(job)
 
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+
+        # ids packed into payloads are out of reach of the JSON search
+        payload_ids = set()
+        for term in search_term.split():
+            try:
+                value = int(term)
+            except ValueError:
+                continue
+            if -2 ** 63 <= value < 2 ** 63:
+                payload_ids |= self.search_payload(queryset, value)
+
+        if payload_ids:
+            results |= queryset.filter(id__in=payload_ids)
+        return results, may_have_duplicates
+
+    def search_payload(self, queryset, value: int) -> set[int]:
+        candidates = (
+            queryset
+            .alias(
+                matches=RawSQL(
+                    f'position(%s in {models.Job._meta.db_table}.payload) > 0',  # noqa: SLF001
+                    [pack_int(value)],
+                    output_field=BooleanField(),
+                ),
+            )
+            .filter(matches=True)
+            .select_related('process')
+            .only('id', 'stage', 'payload', 'process__workflow_class')
+        )[:PAYLOAD_SEARCH_LIMIT]
+
+        # the bytes may span two fields, unpacked values tell for sure
+        found = set()
+        for job in candidates:
+            data = self.get_payload_data(job) or {}
+            ints = [field for field in data.values() if isinstance(field, int) and not isinstance(field, bool)]
+            if value in ints:
+                found.add(job.id)
+        return found
+
+    def get_payload_data(self, obj) -> dict | None:
+        if not obj.payload:
+            return None
+        schema = manager.get_workflow_class(obj.process.workflow_class).payload_schemas.get(obj.stage)
+        return schema.unpack(obj.payload) if schema else None
+
+    @admin.display(description='Payload')
+    def payload_data(self, obj):
+        return self.get_payload_data(obj)
+
+    @admin.display(description='Progress')
+    def progress(self, obj):
+        live = progress_store.read(obj.id)
+        if live:
+            progress = models.JobProgress(job=obj, current=live['current'], total=live['total'])
+        else:
+            try:
+                progress = obj.progress
+            except models.JobProgress.DoesNotExist:
+                return None
+        return f'{progress.current:.0f}/{progress.total:.0f} ({progress.percentage:.1f}%)'
+
     def has_add_permission(self, request):
         return False
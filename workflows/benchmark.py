@@ -0,0 +1,135 @@
+import asyncio
+from collections import defaultdict
+from math import ceil
+from threading import Lock
+from time import perf_counter, sleep
+
+from workflows.constants import JOB_PLANNED
+from workflows.models import Job, Process
+from workflows.workflow import AsyncWorkflow, Workflow
+
+DAG_SHAPES = ('chain', 'fan_out', 'fan_in', 'diamond')
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def format_latencies(values: list[float]) -> str:
+    return ', '.join(
+        f'{name}={percentile(values, percent) * 1000:.2f}ms'
+        for name, percent in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))
+    )
+
+
+def build_dag(shape: str, size: int, root: Job, data: dict = None) -> list[dict]:
+    """
+    Job specs for create_jobs_bulk of the given shape:
+    chain - each job waits for the previous one
+    fan_out - all jobs wait only for the root
+    fan_in - all jobs but the last run in parallel, the last one waits for all of them
+    diamond - chain of diamonds, two parallel jobs joined by the third one
+    """
+    jobs = []
+
+    def add(parents: list) -> int:
+        key = len(jobs)
+        jobs.append({
+            'key': key,
+            'stage': 'work',
+            'parents': parents,
+            'data': {**(data or {}), 'key': key, 'parent_keys': [p for p in parents if p is not root]},
+            'status': JOB_PLANNED,
+        })
+        return key
+
+    if shape == 'chain':
+        previous = root
+        for _ in range(size):
+            previous = add([previous])
+    elif shape == 'fan_out':
+        for _ in range(size):
+            add([root])
+    elif shape == 'fan_in':
+        add([add([root]) for _ in range(max(size - 1, 1))])
+    elif shape == 'diamond':
+        previous = root
+        for _ in range(max(size // 3, 1)):
+            previous = add([add([previous]), add([previous])])
+    else:
+        raise ValueError(f'Unknown DAG shape {shape}, expected one of {DAG_SHAPES}')
+
+    return jobs
+
+
+class BenchmarkRecorder:
+    """
+    Keeps when jobs finished and started, dispatch latency of a job is the time
+    between its last parent finished and its start
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.finished = {}
+        self.latencies = defaultdict(list)
+
+    def reset(self):
+        with self.lock:
+            self.finished.clear()
+            self.latencies.clear()
+
+    def start(self, process: Process, job: Job):
+        started_at = perf_counter()
+        parent_keys = job.data.get('parent_keys') or ['root']
+        with self.lock:
+            ready_at = max(self.finished.get((process.id, key), started_at) for key in parent_keys)
+            self.latencies[process.workflow_class].append(started_at - ready_at)
+
+    def finish(self, process: Process, job: Job):
+        with self.lock:
+            self.finished[(process.id, job.data.get('key', 'root'))] = perf_counter()
+
+    def get_latencies(self) -> list[float]:
+        return [latency for latencies in self.latencies.values() for latency in latencies]
+
+
+recorder = BenchmarkRecorder()
+
+
+class BenchmarkWorkflow(Workflow):
+    """Synthetic workflow, prepare builds the DAG from process data and work stages only sleep"""
+
+    def prepare(self, process: Process, job: Job):
+        self.create_jobs_bulk(
+            process,
+            build_dag(process.data['shape'], process.data['size'], job, {'sleep': process.data.get('sleep', 0)}),
+        )
+        recorder.finish(process, job)
+        self.done_job(job)
+
+    def work(self, process: Process, job: Job):
+        recorder.start(process, job)
+        if job.data.get('sleep'):
+            sleep(job.data['sleep'])
+        recorder.finish(process, job)
+        self.done_job(job)
+
+
+class AsyncBenchmarkWorkflow(AsyncWorkflow):
+    async def prepare(self, process: Process, job: Job):
+        await self.create_jobs_bulk(
+            process,
+            build_dag(process.data['shape'], process.data['size'], job, {'sleep': process.data.get('sleep', 0)}),
+        )
+        recorder.finish(process, job)
+        await self.done_job(job)
+
+    async def work(self, process: Process, job: Job):
+        recorder.start(process, job)
+        if job.data.get('sleep'):
+            await asyncio.sleep(job.data['sleep'])
+        recorder.finish(process, job)
+        await self.done_job(job)
@@ -23,3 +23,5 @@ JOB_STATUSES = (
 )
 
 WORKFLOW_CLASSES = (('altcoin.collection.CollectionWorkflow', 'altcoin.collection.CollectionWorkflow'),)
+
+JOBS_NOTIFY_CHANNEL = 'workflows_jobs'
@@ -0,0 +1,94 @@
+import logging
+from functools import partial
+from threading import Lock
+from time import monotonic
+
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, transaction
+
+from workflows.models import JobLog, ProcessLog
+
+FLUSH_SIZE = 500
+FLUSH_INTERVAL = 2
+BULK_BATCH_SIZE = 1000
+
+
+class LogWriter:
+    """
+    Buffers JobLog and ProcessLog rows in memory
+    and writes them with bulk_create when the buffer is big or old enough.
+    Rows are buffered when their transaction commits, so a rollback discards them.
+    Without a manager loop owning the writer, e.g. in web workers, rows are written right away
+    """
+
+    def __init__(self, flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffered_at = None
+        self.lock = Lock()
+        # set while a manager loop runs and flushes the buffer
+        self.owned = False
+
+    def add(self, log: JobLog | ProcessLog):
+        with self.lock:
+            if not self.buffer:
+                self.buffered_at = monotonic()
+            self.buffer.append(log)
+
+    def is_due(self) -> bool:
+        if not self.buffer:
+            return False
+        return len(self.buffer) >= self.flush_size or monotonic() - self.buffered_at >= self.flush_interval
+
+    def write(self, log: JobLog | ProcessLog):
+        # runs right away outside of a transaction
+        transaction.on_commit(partial(self.commit, log))
+
+    def commit(self, log: JobLog | ProcessLog):
+        self.add(log)
+        if self.owned:
+            self.flush_if_due()
+        else:
+            self.flush()
+
+    async def awrite(self, log: JobLog | ProcessLog):
+        self.add(log)
+        if not self.owned or self.is_due():
+            await self.aflush()
+
+    def flush_if_due(self):
+        if self.is_due():
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            logs, self.buffer = self.buffer, []
+
+        for model in (JobLog, ProcessLog):
+            rows = [log for log in logs if isinstance(log, model)]
+            if rows:
+                self.save_rows(model, rows)
+
+    async def aflush(self):
+        await sync_to_async(self.flush)()
+
+    def save_rows(self, model, rows: list):
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+        except DatabaseError as e:
+            # some row refers to a job or process whose transaction was rolled back
+            logging.warning(f'Failed to write {len(rows)} {model.__name__} rows in bulk: {e}')
+        else:
+            return
+
+        for row in rows:
+            try:
+                with transaction.atomic():
+                    row.save()
+            except DatabaseError as e:
+                logging.warning(f'Dropped {model.__name__} "{row.message}": {e}')
+
+
+log_writer = LogWriter()
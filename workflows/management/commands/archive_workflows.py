@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from workflows.retention import ARCHIVE_BATCH_SIZE, archive_processes, get_expired_processes
+
+
+class Command(BaseCommand):
+    help = 'Archive finished processes with their jobs and logs and remove them from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.WORKFLOWS_RETENTION_DAYS)
+        parser.add_argument(
+            '--dir',
+            dest='archive_dir',
+            default=settings.WORKFLOWS_ARCHIVE_DIR,
+            help='Directory for archive files',
+        )
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--no-archive', action='store_true', help='Only remove processes')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, days: int, archive_dir: str, batch_size: int, no_archive: bool, dry_run: bool, **options):
+        older_than = timedelta(days=days)
+
+        if dry_run:
+            count = get_expired_processes(older_than).count()
+            self.stdout.write(f'{count} processes finished more than {days} days ago')
+            return
+
+        archived = archive_processes(older_than, None if no_archive else archive_dir, batch_size)
+        self.stdout.write(self.style.SUCCESS(f'{archived} processes archived'))
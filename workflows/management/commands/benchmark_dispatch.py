@@ -0,0 +1,81 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from workflows.benchmark import format_latencies
+from workflows.constants import JOB_ACTIVE, JOB_FAILED, JOB_SUCCESS, PROCESS_DONE
+from workflows.manager import manager
+from workflows.models import Job, Process
+from workflows.workflow import Workflow
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the dispatcher query against a large history of finished jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, default=1_000_000, help='Finished jobs to generate')
+        parser.add_argument('--active', type=int, default=100, help='Active jobs to generate')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, history: int, active: int, iterations: int, **options):
+        # everything is rolled back at the end, running workers never see generated jobs
+        with transaction.atomic():
+            process = Process.objects.create(
+                workflow_class=manager.get_workflow_class_str(Workflow),
+                status=PROCESS_DONE,
+                data={'benchmark': True},
+            )
+
+            self.stdout.write(f'Generating {history} finished and {active} active jobs')
+            self.generate_jobs(process, history, active)
+
+            queryset = manager.get_dispatch_queryset().select_for_update(skip_locked=True, of=('self',))
+
+            with connection.cursor() as cursor:
+                sql, params = queryset[:1].query.sql_with_params()
+                cursor.execute(f'EXPLAIN ANALYZE {sql}', params)
+                self.stdout.write('\n'.join(row[0] for row in cursor.fetchall()))
+
+            latencies = []
+            for _ in range(iterations):
+                started_at = perf_counter()
+                list(queryset[:1])
+                latencies.append(perf_counter() - started_at)
+
+            self.stdout.write(self.style.SUCCESS(f'Dispatch latency: {format_latencies(latencies)}'))
+
+            transaction.set_rollback(True)
+
+    def generate_jobs(self, process: Process, history: int, active: int):
+        # generated on the database side, creating a million of models is too slow
+        table = Job._meta.db_table  # noqa: SLF001
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (
+                    process_id, stage, status, priority, attempts, data, created_at, touched_at, done_at
+                )
+                SELECT
+                    %s,
+                    'benchmark',
+                    CASE WHEN n %% 10 = 0 THEN %s ELSE %s END,
+                    %s,
+                    0,
+                    '{{}}',
+                    now() - n * interval '1 second',
+                    now() - n * interval '1 second',
+                    now() - n * interval '1 second'
+                FROM generate_series(1, %s) AS n
+                """,  # noqa: S608
+                [process.id, JOB_FAILED, JOB_SUCCESS, process.priority, history],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (process_id, stage, status, priority, attempts, data, created_at, touched_at)
+                SELECT %s, 'benchmark', %s, %s, 0, '{{}}', now(), now() + n * interval '1 second'
+                FROM generate_series(1, %s) AS n
+                """,  # noqa: S608
+                [process.id, JOB_ACTIVE, process.priority, active],
+            )
+            cursor.execute(f'ANALYZE {table}')
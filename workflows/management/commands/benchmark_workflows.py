@@ -0,0 +1,84 @@
+import asyncio
+from time import perf_counter
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from workflows.benchmark import (
+    DAG_SHAPES,
+    AsyncBenchmarkWorkflow,
+    BenchmarkWorkflow,
+    format_latencies,
+    recorder,
+)
+from workflows.manager import DEFAULT_CONCURRENCY, AsyncManager, Manager
+from workflows.models import Job, JobLog, Process
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark throughput of workflow managers on synthetic DAGs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--manager', choices=('sync', 'async'), default='sync')
+        parser.add_argument('--shape', choices=DAG_SHAPES, default='chain')
+        parser.add_argument('--size', type=int, default=100, help='Jobs per process')
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds every job sleeps')
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Async manager only')
+        parser.add_argument('--keep', action='store_true', help='Keep benchmark processes after the run')
+
+    def handle(self, *args, **options):
+        is_async = options['manager'] == 'async'
+        workflow_class = AsyncBenchmarkWorkflow if is_async else BenchmarkWorkflow
+
+        manager = AsyncManager(concurrency=options['concurrency']) if is_async else Manager()
+        # never touch real jobs if the benchmark runs against a live database
+        manager.workflow_classes = [manager.get_workflow_class_str(workflow_class)]
+
+        stage_data = {'shape': options['shape'], 'size': options['size'], 'sleep': options['sleep']}
+        processes = [
+            Manager().create_process(None, workflow_class, stage_data=stage_data)[0]
+            for _ in range(options['processes'])
+        ]
+
+        recorder.reset()
+        counter = QueryCounter()
+        started_at = perf_counter()
+
+        if is_async:
+            asyncio.run(self.run_async(manager, counter))
+        else:
+            with connection.execute_wrapper(counter):
+                manager.run(None, stop_on_jobs_end=True)
+
+        elapsed = perf_counter() - started_at
+        jobs = Job.objects.filter(process__in=processes).count()
+
+        self.stdout.write(f'Processes: {len(processes)}, jobs: {jobs}, elapsed: {elapsed:.2f}s')
+        self.stdout.write(self.style.SUCCESS(f'Throughput: {jobs / elapsed:.1f} jobs/sec'))
+        self.stdout.write(f'Dispatch latency: {format_latencies(recorder.get_latencies())}')
+        self.stdout.write(f'Queries per job: {counter.count / jobs:.1f}')
+
+        if not options['keep']:
+            JobLog.objects.filter(job__process__in=processes).delete()
+            Job.parents.through.objects.filter(from_job__process__in=processes).delete()
+            Job.objects.filter(process__in=processes).delete()
+            Process.objects.filter(id__in=[process.id for process in processes]).delete()
+
+    async def run_async(self, manager: AsyncManager, counter: QueryCounter):
+        # ORM calls of the async manager run in the sync thread, so the counter is installed there
+        await sync_to_async(lambda: connection.execute_wrappers.append(counter))()
+        try:
+            await manager.run(None, stop_on_jobs_end=True)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(counter))()
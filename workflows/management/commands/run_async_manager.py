@@ -1,9 +1,11 @@
 import asyncio
 import logging
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from workflows.manager import async_manager
+from workflows.manager import DEFAULT_CONCURRENCY, async_manager
+from workflows.metrics import start_metrics_server
 
 logging.basicConfig(
     level=logging.INFO,
@@ -15,9 +17,17 @@ logging.basicConfig(
 class Command(BaseCommand):
     help = 'Run a worker asynchronously'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+        parser.add_argument('--metrics-port', type=int, default=settings.WORKFLOWS_METRICS_PORT)
+
     async def handle_async(self, *args, **options):
         logging.info('Starting async worker')
 
+        async_manager.concurrency = options['concurrency']
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+
         await async_manager.run(None)
 
     def handle(self, *args, **options):
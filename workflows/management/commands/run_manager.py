@@ -1,13 +1,20 @@
 import logging
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
 from workflows.manager import manager
+from workflows.metrics import start_metrics_server
 
 
 class Command(BaseCommand):
     help = 'Run a worker'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--metrics-port', type=int, default=settings.WORKFLOWS_METRICS_PORT)
+
     def handle(self, *args, **options):
         logging.info('Starting worker')
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
         manager.run(None)
@@ -0,0 +1,49 @@
+import logging
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from workflows.manager import DEFAULT_CONCURRENCY, DEFAULT_LEASE_TIMEOUT
+from workflows.pool import SHUTDOWN_TIMEOUT, STATS_INTERVAL, WorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument(
+            '--workflow',
+            action='append',
+            dest='workflow_classes',
+            help='Run only jobs of this workflow class, can be repeated',
+        )
+        parser.add_argument('--lease-timeout', type=int, default=DEFAULT_LEASE_TIMEOUT)
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help='Jobs run at once by each worker of async workflows',
+        )
+        parser.add_argument('--stats-interval', type=float, default=STATS_INTERVAL)
+        parser.add_argument('--shutdown-timeout', type=float, default=SHUTDOWN_TIMEOUT)
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            default=settings.WORKFLOWS_METRICS_PORT,
+            help='Worker N serves its metrics on this port + N',
+        )
+
+    def handle(self, *args, **options):
+        logging.info(f'Starting pool of {options["workers"]} workers')
+
+        WorkerPool(
+            workers=options['workers'],
+            workflow_classes=options['workflow_classes'],
+            lease_timeout=options['lease_timeout'],
+            stats_interval=options['stats_interval'],
+            shutdown_timeout=options['shutdown_timeout'],
+            metrics_port=options['metrics_port'],
+            concurrency=options['concurrency'],
+        ).run()
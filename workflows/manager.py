@@ -1,18 +1,40 @@
 import asyncio
 import logging
+from collections import Counter
 from datetime import timedelta
-from time import sleep, time
+from functools import partial
+from os import getpid
+from socket import gethostname
+from time import time
 
+from asgiref.sync import sync_to_async
 from django.db import transaction
-from django.db.models import Q
-from django.utils.module_loading import import_string
+from django.db.models import F, Min, Q
 from django.utils.timezone import now
 
-from workflows.constants import JOB_ACTIVE
+from workflows.constants import JOB_ACTIVE, PROCESS_ACTIVE
+from workflows.logs import log_writer
+from workflows.metrics import (
+    claim_duration,
+    job_duration,
+    job_errors,
+    job_retries_exhausted,
+    jobs_throttled,
+    jobs_total,
+)
 from workflows.models import Job, Process
-from workflows.workflow import Workflow
+from workflows.notifications import JobsListener, anotify_jobs, notify_jobs
+from workflows.rate_limit import rate_limiter
+from workflows.registry import workflow_registry
+from workflows.workflow import AsyncWorkflow, Workflow
 
 DEFAULT_EXECUTION_TIMEOUT = 60
+DEFAULT_LEASE_TIMEOUT = 10 * 60
+DEFAULT_CONCURRENCY = 10
+# how many extra candidates are locked to fill the batch when some of them don't fit concurrency or rate limits
+CLAIM_LOOKAHEAD = 4
+# safety poll interval when notifications are available but nothing wakes the manager up
+IDLE_TIMEOUT = 30
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,170 +44,500 @@ logging.basicConfig(
 
 
 class Manager:
+    def __init__(
+            self,
+            worker_id: str = None,
+            lease_timeout: int = DEFAULT_LEASE_TIMEOUT,
+            workflow_classes: list[str] = None,
+    ):
+        self._worker_id = worker_id
+        self.lease_timeout = lease_timeout
+        # run only jobs of these workflows, all of them by default
+        self.workflow_classes = workflow_classes
+        self.listener = JobsListener()
+        self.stopping = False
+        self.claimed_at = None
+        # workflows run by the other kind of manager, found while claiming
+        self.foreign_workflow_classes = set()
+
+    @property
+    def worker_id(self) -> str:
+        # resolved lazily, so forked workers get their own id
+        return self._worker_id or f'{gethostname()}:{getpid()}'
+
+    def stop(self):
+        # safe to call from a signal handler, the current job is finished first
+        self.stopping = True
+        self.listener.interrupt()
+
     def run(self, timeout=DEFAULT_EXECUTION_TIMEOUT, stop_on_jobs_end: bool = False):
         run_until = time() + timeout if timeout else None
+        log_writer.owned = True
 
-        while True:
-            if run_until and time() > run_until:
-                break
+        try:
+            while not self.stopping:
+                if run_until and time() > run_until:
+                    break
+
+                # this always select next job
+                # so if any job created new one, then it will be executed almost immediately
+                # ordered by touch mark
+                job = self.claim_job()
+
+                if not job:
+                    logging.info('No jobs')
+                    log_writer.flush()
+                    if stop_on_jobs_end:
+                        return
+                    self.listener.wait(self.get_idle_timeout(run_until))
+                    continue
+
+                self.listener.reset()
+
+                try:
+                    self.run_job(job)
+                finally:
+                    # touch job, this moves job to the end of queue
+                    # todo add triggers in loader to remo jons from queue without processing
+                    self.release_job(job)
+                    log_writer.flush_if_due()
+        finally:
+            log_writer.owned = False
+            log_writer.flush()
+
+    def get_eligible_jobs(self):
+        current_time = now()
+        jobs = (
+            Job.objects.filter(
+                status=JOB_ACTIVE,
+            )
+            .filter(
+                Q(debounced_till__isnull=True) | Q(debounced_till__lte=current_time),
+            )
+            .filter(
+                # not claimed by anyone or the lease of a crashed worker has expired
+                Q(claimed_till__isnull=True) | Q(claimed_till__lte=current_time),
+            )
+        )
 
-            # this always select next job
-            # so if any job created new one, then it will be executed almost immediately
-            # ordered by touch mark
-            job = (
-                Job.objects.filter(
-                    status=JOB_ACTIVE,
-                )
-                .filter(
-                    Q(debounced_till__isnull=True) | Q(debounced_till__lte=now()),
+        if self.workflow_classes:
+            jobs = jobs.filter(process__workflow_class__in=self.workflow_classes)
+        if self.foreign_workflow_classes:
+            jobs = jobs.exclude(process__workflow_class__in=self.foreign_workflow_classes)
+
+        return jobs
+
+    def accepts_workflow(self, workflow_class: str) -> bool:
+        return not issubclass(self.get_workflow_class(workflow_class), AsyncWorkflow)
+
+    def get_dispatch_queryset(self):
+        # higher priority first, then processes take turns, then the oldest job of a process
+        return self.get_eligible_jobs().order_by(
+            '-priority',
+            F('process__dispatched_at').asc(nulls_first=True),
+            'touched_at',
+        )
+
+    def interleave_jobs(self, candidates: list[Job]) -> list[Job]:
+        """Candidates of the same priority in turns of their processes, so one batch isn't taken by one process"""
+        queues = {}
+        for job in candidates:
+            queues.setdefault(job.priority, {}).setdefault(job.process_id, []).append(job)
+
+        jobs = []
+        for priority in sorted(queues, reverse=True):
+            by_process = list(queues[priority].values())
+            for turn in range(max(len(process_jobs) for process_jobs in by_process)):
+                jobs.extend(process_jobs[turn] for process_jobs in by_process if turn < len(process_jobs))
+        return jobs
+
+    def get_idle_timeout(self, run_until: float = None) -> float:
+        timeout = IDLE_TIMEOUT
+        if run_until:
+            # never sleep past the end of the run
+            timeout = max(min(timeout, run_until - time()), 0)
+
+        # wake up by ourselves when the nearest debounce expires, nobody notifies about it
+        # debounces expired since the last claim count too, the claim didn't see their jobs yet
+        debounced_till = (
+            Job.objects.filter(
+                status=JOB_ACTIVE,
+                debounced_till__gt=self.claimed_at or now(),
+            )
+            .aggregate(
+                Min('debounced_till'),
+            )
+            .get('debounced_till__min')
+        )
+
+        if not debounced_till:
+            return timeout
+
+        return max(min((debounced_till - now()).total_seconds(), timeout), 0)
+
+    @transaction.atomic
+    def claim_jobs(self, limit: int = 1, accept=None) -> list[Job]:
+        self.claimed_at = now()
+        with claim_duration.time():
+            # rows locked by other workers are skipped, so parallel managers never wait for each other
+            candidates = (
+                self.get_dispatch_queryset()
+                .select_for_update(
+                    skip_locked=True,
+                    of=('self',),
                 )
                 .select_related(
                     'process',
                 )
-                .prefetch_related(
-                    'parents',
-                    'children',
-                )
-                .order_by(
-                    'touched_at',
-                )
-                .first()
+            )[: limit * CLAIM_LOOKAHEAD]
+
+            jobs = []
+            for job in self.interleave_jobs(list(candidates)):
+                if len(jobs) >= limit:
+                    break
+                if not self.accepts_workflow(job.process.workflow_class):
+                    # stages of async workflows can't run in the sync loop and the other way round
+                    self.foreign_workflow_classes.add(job.process.workflow_class)
+                    continue
+                if accept and not accept(job):
+                    continue
+                if self.throttle_job(job):
+                    continue
+                jobs.append(job)
+
+            if not jobs:
+                return jobs
+
+            for job in jobs:
+                if job.claimed_by:
+                    logging.warning(f'Reclaiming job {job.id} with expired lease of {job.claimed_by}')
+                job.claimed_by = self.worker_id
+                job.claimed_till = now() + timedelta(seconds=self.lease_timeout)
+
+            Job.objects.filter(id__in=[job.id for job in jobs]).update(
+                claimed_by=self.worker_id,
+                claimed_till=jobs[0].claimed_till,
             )
+            # served processes go to the end of the turn once the claim is committed
+            transaction.on_commit(partial(self.mark_dispatched, {job.process_id for job in jobs}))
+
+            return jobs
+
+    @transaction.atomic
+    def mark_dispatched(self, process_ids: set[int]):
+        # processes locked by their running stages keep the turn this time instead of blocking the dispatcher
+        Process.objects.filter(
+            id__in=Process.objects.filter(id__in=process_ids).select_for_update(skip_locked=True).values('id'),
+        ).update(
+            dispatched_at=now(),
+        )
 
-            if not job:
-                logging.info('No jobs')
-                if stop_on_jobs_end:
-                    return
-                sleep(1)
-                continue
-
-            self.run_job(job)
-
-            # touch job, this moves job to the end of queue
-            # todo add triggers in loader to remo jons from queue without processing
-            job.touched_at = now()
-            job.save(update_fields=['touched_at'])
+    def throttle_job(self, job: Job) -> bool:
+        limits = self.get_workflow_class(job.process.workflow_class).get_rate_limits(job.stage)
+        if not limits:
+            return False
+
+        wait = rate_limiter.throttle(limits, job.process, job)
+        if not wait:
+            return False
+
+        # postponed without running, so it's not an attempt
+        Job.objects.filter(id=job.id).update(debounced_till=now() + timedelta(seconds=wait))
+        jobs_throttled.inc(**self.get_metric_labels(job))
+        return True
+
+    def claim_job(self) -> Job | None:
+        jobs = self.claim_jobs()
+        return jobs[0] if jobs else None
+
+    def release_job(self, job: Job):
+        Job.objects.filter(id=job.id, claimed_by=self.worker_id).update(
+            claimed_by=None,
+            claimed_till=None,
+            touched_at=now(),
+        )
 
     def run_job(self, job: Job):
-        workflow = self.get_workflow(job.process.workflow_class)
+        workflow = self.get_workflow(job.process.workflow_class, job.process)
+        labels = self.get_metric_labels(job)
+        jobs_total.inc(**labels)
 
         try:
-            with transaction.atomic():
-                job = Job.objects.select_for_update().get(id=job.id)
-                getattr(workflow, job.stage)(process=job.process, job=job)
+            with job_duration.time(**labels), transaction.atomic(), workflow.batch_job_counters():
+                job = workflow.load_job_data(Job.objects.select_for_update().get(id=job.id))
+                workflow_registry.get_stage(workflow, job.stage)(process=job.process, job=job)
         except Exception as err:
-            logging.exception(err)
-
             logging.exception(err)
             try:
-                workflow.job_log(job=job, message=f'Error: {err}')
+                self.retry_job(workflow, job, err)
             except Exception as e:
                 logging.exception(e)
 
-            # debounce job in case of unexpected error
-            job.debounced_till = now() + timedelta(minutes=1)
-            job.save(update_fields=['debounced_till'])
+                # debounce job in case of unexpected error
+                Job.objects.filter(id=job.id).update(debounced_till=now() + timedelta(minutes=1))
 
-    def get_workflow(self, workflow_class) -> Workflow:
-        try:
-            workflow_class = import_string(workflow_class)
-        except (ModuleNotFoundError, ImportError):
-            raise Exception(f'Workflow isn`t found in {workflow_class}')
+        self.evict_workflow(job.process)
+
+    def get_metric_labels(self, job: Job) -> dict:
+        return {'workflow_class': job.process.workflow_class, 'stage': job.stage}
+
+    def retry_job(self, workflow: Workflow, job: Job, err: Exception):
+        job_errors.inc(**self.get_metric_labels(job))
 
-        workflow = workflow_class()
+        # the failed transaction is rolled back, in-memory changes of the stage are not
+        job.refresh_from_db(fields=('status', 'attempts'))
+        if job.status != JOB_ACTIVE:
+            return
 
-        if not isinstance(workflow, Workflow):
-            raise TypeError(f'Class {workflow_class} isn`t instance of Workflow')
+        job.attempts += 1
+        policy = workflow.get_retry_policy(job, err)
+        delay = policy.get_delay(job.attempts, err) if policy else None
 
-        return workflow
+        if delay is None:
+            job_retries_exhausted.inc(**self.get_metric_labels(job))
+            job.save(update_fields=['attempts'])
+            workflow.job_log(job=job, message=f'Error: {err}, giving up after {job.attempts} attempts')
+            workflow.fail_job(job)
+            return
+
+        job.debounced_till = now() + timedelta(seconds=delay)
+        job.save(update_fields=['attempts', 'debounced_till'])
+        workflow.job_log(job=job, message=f'Error: {err}, attempt {job.attempts} retries in {delay:.0f}s')
+
+    def get_workflow(self, workflow_class, process: Process = None) -> Workflow:
+        # instances live as long as their process, so their caches are shared between its jobs
+        return workflow_registry.get_instance(workflow_class, process.id if process else None)
+
+    def evict_workflow(self, process: Process):
+        if process.status != PROCESS_ACTIVE:
+            workflow_registry.evict(process.workflow_class, process.id)
 
     def get_workflow_class(self, workflow_class) -> type[Workflow]:
-        return self.get_workflow(workflow_class).__class__
+        return workflow_registry.get_class(workflow_class)
 
     def get_workflow_class_str(self, workflow_class: Workflow) -> str:
         return f'{workflow_class.__module__}.{workflow_class.__name__}'
 
-    def create_process(self, config, workflow_class: Workflow, stage: str = None, stage_data: dict = None):
+    def create_process(
+            self,
+            config,
+            workflow_class: Workflow,
+            stage: str = None,
+            stage_data: dict = None,
+            priority: int = None,
+    ):
         process = Process.objects.create(
             workflow_class=self.get_workflow_class_str(workflow_class),
             config=config,
             data=stage_data or {},
+            jobs_pending=1,
+            priority=workflow_class.priority if priority is None else priority,
         )
 
+        stage = stage or workflow_class.default_stage
+        data, payload = self.get_workflow(process.workflow_class).split_job_data(stage, stage_data)
         job = Job.objects.create(
             process=process,
-            stage=stage or workflow_class.default_stage,
-            data=stage_data or {},
+            stage=stage,
+            data=data,
+            payload=payload,
             status=JOB_ACTIVE,  # first job always active
+            priority=process.priority,
         )
 
+        notify_jobs()
+
         return process, job
 
 
 class AsyncManager(Manager):
+    def __init__(self, *args, concurrency: int = DEFAULT_CONCURRENCY, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency
+        self.running = Counter()
+
+    def accepts_workflow(self, workflow_class: str) -> bool:
+        return issubclass(self.get_workflow_class(workflow_class), AsyncWorkflow)
+
     async def run(self, timeout=DEFAULT_EXECUTION_TIMEOUT, stop_on_jobs_end: bool = False):
+        log_writer.owned = True
+        try:
+            await self._run(timeout, stop_on_jobs_end)
+        finally:
+            log_writer.owned = False
+            await log_writer.aflush()
+
+    async def _run(self, timeout, stop_on_jobs_end: bool):
         run_until = time() + timeout if timeout else None
+        tasks = set()
 
-        while True:
+        while not self.stopping:
             if run_until and time() > run_until:
                 break
 
-            job = await Job.objects.filter(
-                status=JOB_ACTIVE,
-            ).filter(
-                Q(debounced_till__isnull=True) | Q(debounced_till__lte=now()),
-            ).select_related(
-                'process',
-            ).prefetch_related(
-                'parents',
-                'children',
-            ).order_by(
-                'touched_at',
-            ).afirst()
-
-            if not job:
+            jobs = []
+            if len(tasks) < self.concurrency:
+                jobs = await sync_to_async(self.claim_jobs)(
+                    self.concurrency - len(tasks),
+                    self.get_slots_filter(),
+                )
+
+            for job in jobs:
+                self.running.update(key for key, _ in self.get_concurrency_limits(job))
+                tasks.add(asyncio.create_task(self.execute_job(job)))
+
+            if not tasks:
                 logging.info('No jobs')
+                await log_writer.aflush()
                 if stop_on_jobs_end:
                     return
-                await asyncio.sleep(1)
+                await self.listener.async_wait(await sync_to_async(self.get_idle_timeout)(run_until))
+                continue
+
+            if jobs:
+                self.listener.reset()
+                continue
+
+            if len(tasks) >= self.concurrency:
+                # all slots are busy, wait for any running job
+                _, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
                 continue
 
+            # nothing to claim, wait for any running job or a new eligible one
+            notified = asyncio.create_task(
+                self.listener.async_wait(await sync_to_async(self.get_idle_timeout)(run_until)),
+            )
+            done, _ = await asyncio.wait({*tasks, notified}, return_when=asyncio.FIRST_COMPLETED)
+            if not notified.done():
+                notified.cancel()
+            tasks -= done
+
+        if tasks:
+            await asyncio.wait(tasks)
+
+    def get_concurrency_limits(self, job: Job) -> list[tuple[tuple, int]]:
+        workflow_class = self.get_workflow_class(job.process.workflow_class)
+
+        limits = []
+        if workflow_class.concurrency:
+            limits.append(((job.process.workflow_class,), workflow_class.concurrency))
+
+        stage_concurrency = workflow_class.stage_concurrency.get(job.stage)
+        if stage_concurrency:
+            limits.append(((job.process.workflow_class, job.stage), stage_concurrency))
+
+        return limits
+
+    def get_slots_filter(self):
+        # claim runs in a sync thread, so it works with a snapshot of running jobs
+        reserved = Counter(self.running)
+
+        def has_free_slot(job: Job) -> bool:
+            limits = self.get_concurrency_limits(job)
+            if any(reserved[key] >= limit for key, limit in limits):
+                return False
+            reserved.update(key for key, _ in limits)
+            return True
+
+        return has_free_slot
+
+    async def execute_job(self, job: Job):
+        # async jobs don't hold a row lock while running, so the lease is kept alive instead
+        heartbeat = asyncio.create_task(self.extend_lease(job))
+        try:
             await self.run_job(job)
+        finally:
+            heartbeat.cancel()
+            self.running.subtract(key for key, _ in self.get_concurrency_limits(job))
+            await self.arelease_job(job)
 
-            job.touched_at = now()
-            await job.asave(update_fields=['touched_at'])
+    async def extend_lease(self, job: Job):
+        while True:
+            await asyncio.sleep(self.lease_timeout / 3)
+            await Job.objects.filter(id=job.id, claimed_by=self.worker_id).aupdate(
+                claimed_till=now() + timedelta(seconds=self.lease_timeout),
+            )
+
+    async def arelease_job(self, job: Job):
+        await Job.objects.filter(id=job.id, claimed_by=self.worker_id).aupdate(
+            claimed_by=None,
+            claimed_till=None,
+            touched_at=now(),
+        )
 
     async def run_job(self, job: Job):
-        workflow = self.get_workflow(job.process.workflow_class)
+        workflow = self.get_workflow(job.process.workflow_class, job.process)
+        labels = self.get_metric_labels(job)
+        jobs_total.inc(**labels)
 
         try:
-            job = await Job.objects.select_related('process').aget(id=job.id)
+            job = workflow.load_job_data(await Job.objects.select_related('process').aget(id=job.id))
             logging.info(f'Running job {job.id} {job.stage}')
-            await getattr(workflow, job.stage)(process=job.process, job=job)
+            with job_duration.time(**labels):
+                await workflow_registry.get_stage(workflow, job.stage)(process=job.process, job=job)
         except Exception as err:
             logging.exception(err)
             try:
-                await workflow.job_log(job=job, message=f'Error: {err}')
+                await self.retry_job(workflow, job, err)
             except Exception as e:
                 logging.exception(e)
 
-            job.debounced_till = now() + timedelta(minutes=1)
-            await job.asave(update_fields=['debounced_till'])
-
-    async def create_process(self, config, workflow_class: Workflow, stage: str = None, stage_data: dict = None):
+                await Job.objects.filter(id=job.id).aupdate(debounced_till=now() + timedelta(minutes=1))
+
+        self.evict_workflow(job.process)
+
+    async def retry_job(self, workflow: Workflow, job: Job, err: Exception):
+        job_errors.inc(**self.get_metric_labels(job))
+
+        # without a transaction the stage may have finished the job before failing
+        await job.arefresh_from_db(fields=('status', 'attempts'))
+        if job.status != JOB_ACTIVE:
+            return
+
+        job.attempts += 1
+        policy = workflow.get_retry_policy(job, err)
+        delay = policy.get_delay(job.attempts, err) if policy else None
+
+        if delay is None:
+            job_retries_exhausted.inc(**self.get_metric_labels(job))
+            await job.asave(update_fields=['attempts'])
+            await workflow.job_log(job=job, message=f'Error: {err}, giving up after {job.attempts} attempts')
+            await workflow.fail_job(job)
+            return
+
+        job.debounced_till = now() + timedelta(seconds=delay)
+        await job.asave(update_fields=['attempts', 'debounced_till'])
+        await workflow.job_log(job=job, message=f'Error: {err}, attempt {job.attempts} retries in {delay:.0f}s')
+
+    async def create_process(
+            self,
+            config,
+            workflow_class: Workflow,
+            stage: str = None,
+            stage_data: dict = None,
+            priority: int = None,
+    ):
         process = await Process.objects.acreate(
             workflow_class=self.get_workflow_class_str(workflow_class),
             config=config,
             data=stage_data or {},
+            jobs_pending=1,
+            priority=workflow_class.priority if priority is None else priority,
         )
 
+        stage = stage or workflow_class.default_stage
+        data, payload = self.get_workflow(process.workflow_class).split_job_data(stage, stage_data)
         job = await Job.objects.acreate(
             process=process,
-            stage=stage or workflow_class.default_stage,
-            data=stage_data or {},
+            stage=stage,
+            data=data,
+            payload=payload,
             status=JOB_ACTIVE,
+            priority=process.priority,
         )
 
+        await anotify_jobs()
+
         return process, job
 
 
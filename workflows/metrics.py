@@ -0,0 +1,275 @@
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, perf_counter
+
+from django.db import connections
+from django.db.models import Count, Min, Q
+from django.utils.timezone import now
+
+from workflows.constants import JOB_ACTIVE, JOB_PLANNED
+from workflows.models import Job
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# queue gauges cost a query, scrapes more often than this get the previous values
+QUEUE_REFRESH_INTERVAL = 5
+STAGE_LABELS = ('workflow_class', 'stage')
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """Metric in the Prometheus text exposition format, values are kept per tuple of label values"""
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = Lock()
+
+    def get_key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def format_labels(self, key: tuple, **extra) -> str:
+        labels = {**dict(zip(self.labelnames, key, strict=True)), **extra}
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + '}'
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            return [
+                f'{self.name}{self.format_labels(key)} {format_value(value)}'
+                for key, value in self.values.items()
+            ]
+
+    def render(self) -> str:
+        return '\n'.join([
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+            *self.samples(),
+        ])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+    def replace(self, values: dict[tuple, float]):
+        # label sets missing from a new snapshot disappear instead of keeping stale values
+        with self.lock:
+            self.values = values
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = (*sorted(buckets), float('inf'))
+
+    def observe(self, value: float, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            series = self.values[key]
+            series['buckets'][bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started_at, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        with self.lock:
+            for key, series in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets'], strict=True):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{self.format_labels(key, le=format_value(bound))} {cumulative}')
+                lines.append(f'{self.name}_sum{self.format_labels(key)} {format_value(series["sum"])}')
+                lines.append(f'{self.name}_count{self.format_labels(key)} {series["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Collectors are called before rendering to refresh gauges"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logging.exception(e)
+
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+registry = MetricsRegistry()
+
+job_duration = registry.register(Histogram(
+    'workflows_job_duration_seconds',
+    'Time a stage takes to run a job',
+    STAGE_LABELS,
+))
+jobs_total = registry.register(Counter(
+    'workflows_jobs_total',
+    'Jobs run by the worker',
+    STAGE_LABELS,
+))
+job_errors = registry.register(Counter(
+    'workflows_job_errors_total',
+    'Jobs failed with an unexpected error',
+    STAGE_LABELS,
+))
+job_retries_exhausted = registry.register(Counter(
+    'workflows_job_retries_exhausted_total',
+    'Jobs failed after their retry policy was exhausted',
+    STAGE_LABELS,
+))
+jobs_throttled = registry.register(Counter(
+    'workflows_jobs_throttled_total',
+    'Jobs postponed by rate limits of their stage',
+    STAGE_LABELS,
+))
+claim_duration = registry.register(Histogram(
+    'workflows_claim_duration_seconds',
+    'Time the worker takes to claim a batch of jobs',
+))
+queue_jobs = registry.register(Gauge(
+    'workflows_queue_jobs',
+    'Unfinished jobs by state: ready to run, running, debounced or planned',
+    (*STAGE_LABELS, 'state'),
+))
+queue_age = registry.register(Gauge(
+    'workflows_queue_oldest_job_age_seconds',
+    'Age of the oldest job ready to run since it was last touched',
+    STAGE_LABELS,
+))
+
+
+class QueueCollector:
+    """Refreshes queue gauges from the database, at most once per interval"""
+
+    def __init__(self, interval: float = QUEUE_REFRESH_INTERVAL):
+        self.interval = interval
+        self.refreshed_at = None
+        self.lock = Lock()
+
+    def __call__(self):
+        with self.lock:
+            if self.refreshed_at and monotonic() - self.refreshed_at < self.interval:
+                return
+            self.refreshed_at = monotonic()
+
+            try:
+                self.refresh()
+            finally:
+                # scrapes come from server threads, their connections would never be reused
+                connections.close_all()
+
+    def refresh(self):
+        current_time = now()
+        active = Q(status=JOB_ACTIVE)
+        debounced = Q(debounced_till__gt=current_time)
+        running = Q(claimed_till__gt=current_time)
+        ready = active & ~debounced & ~running
+        rows = (
+            Job.objects.filter(
+                status__in=(JOB_ACTIVE, JOB_PLANNED),
+            )
+            .values(
+                'process__workflow_class',
+                'stage',
+            )
+            .annotate(
+                ready=Count('id', filter=ready),
+                running=Count('id', filter=active & running),
+                debounced=Count('id', filter=active & debounced & ~running),
+                planned=Count('id', filter=Q(status=JOB_PLANNED)),
+                oldest=Min('touched_at', filter=ready),
+            )
+        )
+
+        counts = {}
+        ages = {}
+        for row in rows:
+            key = (row['process__workflow_class'], row['stage'])
+            for state in ('ready', 'running', 'debounced', 'planned'):
+                counts[(*key, state)] = row[state]
+            if row['oldest']:
+                ages[key] = max((current_time - row['oldest']).total_seconds(), 0)
+
+        queue_jobs.replace(counts)
+        queue_age.replace(ages)
+
+
+registry.add_collector(QueueCollector())
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # noqa: N802
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+def start_metrics_server(port: int, address: str = '0.0.0.0') -> ThreadingHTTPServer:  # noqa: S104
+    """Serves /metrics of this worker process from a daemon thread"""
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='workflows-metrics', daemon=True).start()
+    logging.info(f'Serving workflow metrics on {address}:{port}/metrics')
+    return server
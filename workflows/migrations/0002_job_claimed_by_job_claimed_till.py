@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='claimed_by',
+            field=models.CharField(blank=True, editable=False, help_text='Worker that currently executes the job', max_length=150, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='claimed_till',
+            field=models.DateTimeField(blank=True, editable=False, help_text='Lease expiry of the claim. Expired claims are reclaimed by other workers', null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0002_job_claimed_by_job_claimed_till'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['touched_at'], include=('debounced_till', 'claimed_till'), name='workflows_job_dispatch_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0003_job_dispatch_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='joblog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='processlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
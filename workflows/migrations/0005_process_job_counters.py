@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:25
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_job_counters(apps, schema_editor):
+    Process = apps.get_model('workflows', 'Process')
+
+    for process in Process.objects.annotate(
+        pending=Count('jobs', filter=~Q(jobs__status__in=('success', 'failed'))),
+        success=Count('jobs', filter=Q(jobs__status='success')),
+        failed=Count('jobs', filter=Q(jobs__status='failed')),
+    ).iterator():
+        Process.objects.filter(id=process.id).update(
+            jobs_pending=process.pending,
+            jobs_success=process.success,
+            jobs_failed=process.failed,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0004_log_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='process',
+            name='jobs_failed',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='jobs_pending',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='jobs_success',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_job_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0005_process_job_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Failed attempts to run the job, it fails when its retry policy is exhausted'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0006_job_attempts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='job',
+            name='workflows_job_dispatch_idx',
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='priority',
+            field=models.IntegerField(default=0, editable=False, help_text='Priority of the process when the job was created, unless the job was given its own'),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When a job of the process was claimed last time, processes of the same priority take turns by it', null=True),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='priority',
+            field=models.IntegerField(default=0, help_text='Jobs of processes with higher priority run first'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['touched_at'], include=('debounced_till', 'claimed_till', 'priority', 'process_id'), name='workflows_job_dispatch_idx'),
+        ),
+    ]
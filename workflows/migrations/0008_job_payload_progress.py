@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 04:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflows', '0007_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobProgress',
+            fields=[
+                ('job', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='progress', serialize=False, to='workflows.job')),
+                ('current', models.BigIntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+                ('speed', models.FloatField(help_text='Units per second', null=True)),
+                ('eta', models.FloatField(help_text='Seconds left', null=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Job progress',
+                'verbose_name_plural': 'Job progress',
+            },
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='payload',
+            field=models.BinaryField(help_text='Typed fields of the data packed by the payload schema of the stage', null=True),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Count, Q
 from django.utils.timezone import now
 
 from workflows.constants import (
@@ -69,6 +70,49 @@ class Process(models.Model):
         editable=False,
     )
 
+    priority = models.IntegerField(
+        default=0,
+        help_text='Jobs of processes with higher priority run first',
+    )
+
+    dispatched_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='When a job of the process was claimed last time, processes of the same priority take turns by it',
+    )
+
+    # updated on every job transition, so completion check and progress don't need to scan jobs
+    jobs_pending = models.IntegerField(
+        default=0,
+        editable=False,
+    )
+
+    jobs_success = models.IntegerField(
+        default=0,
+        editable=False,
+    )
+
+    jobs_failed = models.IntegerField(
+        default=0,
+        editable=False,
+    )
+
+    @property
+    def jobs_total(self):
+        return self.jobs_pending + self.jobs_success + self.jobs_failed
+
+    def refresh_job_counters(self):
+        counters = self.jobs.aggregate(
+            jobs_pending=Count('id', filter=~Q(status__in=(JOB_SUCCESS, JOB_FAILED))),
+            jobs_success=Count('id', filter=Q(status=JOB_SUCCESS)),
+            jobs_failed=Count('id', filter=Q(status=JOB_FAILED)),
+        )
+        Process.objects.filter(id=self.id).update(**counters)
+
+        for field, value in counters.items():
+            setattr(self, field, value)
+
     def __str__(self):
         return f'#{self.id}/ {self.config}'
 
@@ -77,6 +121,16 @@ class Job(models.Model):
     class Meta:
         verbose_name = 'Job'
         verbose_name_plural = 'Jobs'
+        indexes = (
+            # serves the dispatcher query, finished jobs never get into it,
+            # active jobs it finds are sorted by priority and turns of their processes
+            models.Index(
+                fields=('touched_at',),
+                include=('debounced_till', 'claimed_till', 'priority', 'process_id'),
+                condition=Q(status=JOB_ACTIVE),
+                name='workflows_job_dispatch_idx',
+            ),
+        )
 
     process = models.ForeignKey(
         'workflows.Process',
@@ -96,12 +150,24 @@ class Job(models.Model):
         default=JOB_ACTIVE,
     )
 
+    priority = models.IntegerField(
+        default=0,
+        editable=False,
+        help_text='Priority of the process when the job was created, unless the job was given its own',
+    )
+
     data = models.JSONField(
         encoder=DjangoJSONEncoder,
         editable=False,
         default=dict,
     )
 
+    payload = models.BinaryField(
+        null=True,
+        editable=False,
+        help_text='Typed fields of the data packed by the payload schema of the stage',
+    )
+
     parents = models.ManyToManyField(
         'self',
         symmetrical=False,
@@ -131,6 +197,27 @@ class Job(models.Model):
         help_text='When last time is was ran. This helps to proceed jobs all round',
     )
 
+    claimed_by = models.CharField(
+        max_length=150,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Worker that currently executes the job',
+    )
+
+    claimed_till = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text='Lease expiry of the claim. Expired claims are reclaimed by other workers',
+    )
+
+    attempts = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Failed attempts to run the job, it fails when its retry policy is exhausted',
+    )
+
     @property
     def is_active(self):
         return self.status == JOB_ACTIVE
@@ -148,6 +235,50 @@ class Job(models.Model):
         return f'{self.stage} #{self.pk}'
 
 
+class JobProgress(models.Model):
+    """Frequently updated progress of a job, kept apart so updates don't rewrite the job data"""
+
+    class Meta:
+        verbose_name = 'Job progress'
+        verbose_name_plural = 'Job progress'
+
+    job = models.OneToOneField(
+        'workflows.Job',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='progress',
+    )
+
+    current = models.BigIntegerField(
+        default=0,
+    )
+
+    total = models.BigIntegerField(
+        default=0,
+    )
+
+    speed = models.FloatField(
+        null=True,
+        help_text='Units per second',
+    )
+
+    eta = models.FloatField(
+        null=True,
+        help_text='Seconds left',
+    )
+
+    updated_at = models.DateTimeField(
+        default=now,
+    )
+
+    @property
+    def percentage(self):
+        return self.current / self.total * 100 if self.total else 0
+
+    def __str__(self):
+        return f'{self.job} - {self.current}/{self.total}'
+
+
 class JobLog(models.Model):
     class Meta:
         verbose_name = 'Job log'
@@ -163,8 +294,9 @@ class JobLog(models.Model):
         editable=False,
     )
 
+    # not auto_now_add, logs are written in batches and keep the time they were logged at
     created_at = models.DateTimeField(
-        auto_now_add=True,
+        default=now,
         editable=False,
     )
 
@@ -188,7 +320,7 @@ class ProcessLog(models.Model):
     )
 
     created_at = models.DateTimeField(
-        auto_now_add=True,
+        default=now,
         editable=False,
     )
 
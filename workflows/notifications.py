@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import select
+from contextlib import suppress
+
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, connection, connections
+
+from workflows.constants import JOBS_NOTIFY_CHANNEL
+
+MIN_POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 5
+
+
+def notify_jobs():
+    """
+    Wakes up managers waiting for jobs.
+    Postgres delivers the notification when the current transaction commits
+    """
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [JOBS_NOTIFY_CHANNEL, ''])
+
+
+async def anotify_jobs():
+    await sync_to_async(notify_jobs)()
+
+
+class Backoff:
+    def __init__(self, minimum: float = MIN_POLL_INTERVAL, maximum: float = MAX_POLL_INTERVAL, factor: float = 2):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.current = minimum
+
+    def next(self) -> float:
+        value = self.current
+        self.current = min(self.current * self.factor, self.maximum)
+        return value
+
+    def reset(self):
+        self.current = self.minimum
+
+
+class JobsListener:
+    """
+    Waits for job notifications on a dedicated autocommit connection.
+    Falls back to adaptive backoff polling when LISTEN isn't available
+    """
+
+    def __init__(self, channel: str = JOBS_NOTIFY_CHANNEL, using: str = 'default'):
+        self.channel = channel
+        self.using = using
+        self.connection = None
+        self.backoff = Backoff()
+        self.wakeup = None
+
+    def connect(self) -> bool:
+        if self.connection is not None and not self.connection.closed:
+            return True
+
+        db = connections[self.using]
+        if db.vendor != 'postgresql':
+            return False
+
+        try:
+            self.connection = db.Database.connect(**db.get_connection_params())
+            self.connection.autocommit = True
+            with self.connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.channel}')
+        except (DatabaseError, db.Database.Error) as e:
+            logging.warning(f'Job notifications are unavailable, falling back to polling: {e}')
+            self.connection = None
+            return False
+
+        return True
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def reset(self):
+        self.backoff.reset()
+
+    def get_wakeup_fd(self) -> int:
+        # self-pipe, lets signal handlers interrupt a wait
+        if self.wakeup is None:
+            self.wakeup = os.pipe()
+            for fd in self.wakeup:
+                os.set_blocking(fd, False)
+        return self.wakeup[0]
+
+    def interrupt(self):
+        self.get_wakeup_fd()
+        with suppress(BlockingIOError):
+            os.write(self.wakeup[1], b'\0')
+
+    def clear_interrupt(self) -> bool:
+        try:
+            return bool(os.read(self.get_wakeup_fd(), 1024))
+        except BlockingIOError:
+            return False
+
+    def drain(self) -> bool:
+        try:
+            self.connection.poll()
+        except self.connection.Error as e:
+            logging.warning(f'Job notifications connection is lost: {e}')
+            self.close()
+            return False
+
+        notified = bool(self.connection.notifies)
+        self.connection.notifies.clear()
+        return notified
+
+    def wait(self, timeout: float) -> bool:
+        if not self.connect():
+            select.select([self.get_wakeup_fd()], [], [], min(self.backoff.next(), timeout))
+            self.clear_interrupt()
+            return False
+
+        readable, _, _ = select.select([self.connection, self.get_wakeup_fd()], [], [], timeout)
+        if self.clear_interrupt():
+            return False
+        return bool(readable) and self.drain()
+
+    async def async_wait(self, timeout: float) -> bool:
+        if not await sync_to_async(self.connect)():
+            await asyncio.sleep(min(self.backoff.next(), timeout))
+            return False
+
+        loop = asyncio.get_running_loop()
+        notified = asyncio.Event()
+        loop.add_reader(self.connection, notified.set)
+        loop.add_reader(self.get_wakeup_fd(), notified.set)
+        try:
+            await asyncio.wait_for(notified.wait(), timeout)
+        except TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(self.connection)
+            loop.remove_reader(self.get_wakeup_fd())
+
+        if self.clear_interrupt():
+            return False
+        return self.drain()
@@ -0,0 +1,92 @@
+import struct
+
+FORMATS = {
+    'int': 'q',
+    'float': 'd',
+    'bool': '?',
+}
+TYPES = {
+    'int': int,
+    'float': float,
+    'bool': bool,
+    'str': str,
+}
+# bitmask of present fields, fixed width so appending a field never changes the layout of stored payloads
+HEADER = struct.Struct('<Q')
+STR_LENGTH = struct.Struct('<H')
+
+
+def pack_int(value: int) -> bytes:
+    """Bytes of an int field as stored in payloads, to find payloads that may hold the value"""
+    return struct.pack(f'<{FORMATS["int"]}', value)
+
+
+class PayloadSchema:
+    """
+    Typed fields of a stage packed into Job.payload with struct instead of the JSON data,
+    e.g. PayloadSchema(channel_id='int', message_id='int').
+    Values that don't match their type exactly stay in the JSON data, e.g. an int of a float field.
+    Payloads are decoded by field order, so new fields are only appended
+    """
+
+    def __init__(self, **fields: str):
+        if len(fields) > HEADER.size * 8:
+            raise ValueError(f'Payload schema supports up to {HEADER.size * 8} fields')
+        for name, field_type in fields.items():
+            if field_type not in TYPES:
+                raise ValueError(f'Unknown type {field_type} of payload field {name}, expected one of {list(TYPES)}')
+        self.fields = fields
+
+    def accepts(self, field_type: str, value) -> bool:
+        if field_type != 'bool' and isinstance(value, bool):
+            return False
+        if field_type == 'int' and isinstance(value, int):
+            return -2 ** 63 <= value < 2 ** 63
+        if field_type == 'str' and isinstance(value, str):
+            return len(value.encode()) < 2 ** 16
+        return isinstance(value, TYPES[field_type])
+
+    def pack(self, data: dict) -> tuple[dict, bytes | None]:
+        """Splits data into the rest of JSON data and packed payload"""
+        rest = dict(data)
+        present = 0
+        values = []
+
+        for index, (name, field_type) in enumerate(self.fields.items()):
+            if name not in rest or not self.accepts(field_type, rest[name]):
+                continue
+
+            value = rest.pop(name)
+            present |= 1 << index
+            if field_type == 'str':
+                encoded = value.encode()
+                values.append(STR_LENGTH.pack(len(encoded)) + encoded)
+            else:
+                values.append(struct.pack(f'<{FORMATS[field_type]}', value))
+
+        if not present:
+            return rest, None
+
+        return rest, HEADER.pack(present) + b''.join(values)
+
+    def unpack(self, payload: bytes) -> dict:
+        payload = bytes(payload)
+        (present,) = HEADER.unpack_from(payload)
+        offset = HEADER.size
+
+        data = {}
+        for index, (name, field_type) in enumerate(self.fields.items()):
+            if not present & (1 << index):
+                continue
+
+            if field_type == 'str':
+                (length,) = STR_LENGTH.unpack_from(payload, offset)
+                offset += STR_LENGTH.size
+                data[name] = payload[offset:offset + length].decode()
+                offset += length
+            else:
+                value_format = f'<{FORMATS[field_type]}'
+                (data[name],) = struct.unpack_from(value_format, payload, offset)
+                offset += struct.calcsize(value_format)
+
+        return data
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+from time import monotonic, sleep
+
+from django.db import connections
+
+from workflows.manager import DEFAULT_CONCURRENCY, DEFAULT_LEASE_TIMEOUT, AsyncManager, Manager
+from workflows.metrics import start_metrics_server
+from workflows.models import Job
+from workflows.notifications import Backoff
+from workflows.registry import workflow_registry
+from workflows.workflow import AsyncWorkflow, Workflow
+
+SUPERVISE_INTERVAL = 1
+STATS_INTERVAL = 60
+# grace time of workers to finish their current jobs on shutdown
+SHUTDOWN_TIMEOUT = 60
+# workers dying faster than this are restarted with growing delays
+MIN_UPTIME = 10
+MAX_RESTART_DELAY = 60
+
+context = multiprocessing.get_context('fork')
+
+
+class WorkerSlot:
+    """Place of one worker process in the pool, counters survive restarts of the worker"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.started_at = None
+        self.restart_at = None
+        self.restarts = 0
+        self.backoff = Backoff(minimum=1, maximum=MAX_RESTART_DELAY)
+        self.jobs = context.Value('L', 0)
+        self.errors = context.Value('L', 0)
+        self.reported_jobs = 0
+
+
+class PoolManager(Manager):
+    """Manager of a pool worker, counts its jobs in memory shared with the supervisor"""
+
+    def __init__(self, slot: WorkerSlot, **kwargs):
+        super().__init__(**kwargs)
+        self.slot = slot
+
+    def run_job(self, job: Job):
+        try:
+            super().run_job(job)
+        finally:
+            with self.slot.jobs.get_lock():
+                self.slot.jobs.value += 1
+
+    def retry_job(self, workflow: Workflow, job: Job, err: Exception):
+        with self.slot.errors.get_lock():
+            self.slot.errors.value += 1
+        super().retry_job(workflow, job, err)
+
+
+class AsyncPoolManager(AsyncManager):
+    """Async manager of a pool worker, runs several jobs of async workflows at once"""
+
+    def __init__(self, slot: WorkerSlot, **kwargs):
+        super().__init__(**kwargs)
+        self.slot = slot
+
+    async def run_job(self, job: Job):
+        try:
+            await super().run_job(job)
+        finally:
+            with self.slot.jobs.get_lock():
+                self.slot.jobs.value += 1
+
+    async def retry_job(self, workflow: Workflow, job: Job, err: Exception):
+        with self.slot.errors.get_lock():
+            self.slot.errors.value += 1
+        await super().retry_job(workflow, job, err)
+
+
+def run_worker(slot: WorkerSlot, manager_kwargs: dict, metrics_port: int = None, is_async: bool = False):
+    manager = AsyncPoolManager(slot, **manager_kwargs) if is_async else PoolManager(slot, **manager_kwargs)
+
+    signal.signal(signal.SIGTERM, lambda *args: manager.stop())
+    # Ctrl+C reaches the whole process group, the supervisor stops workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    logging.info(f'Worker {slot.index} started as {manager.worker_id}')
+
+    server = None
+    if metrics_port:
+        # metrics live in the memory of each worker, so every worker serves its own endpoint
+        server = start_metrics_server(metrics_port + slot.index)
+
+    try:
+        if is_async:
+            asyncio.run(manager.run(None))
+        else:
+            manager.run(None)
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        manager.listener.close()
+        connections.close_all()
+    logging.info(f'Worker {slot.index} stopped')
+
+
+class WorkerPool:
+    """
+    Forks worker processes running the synchronous manager loop, so blocking workflows use every core.
+    Workers of async workflows run the async manager loop, workflows of both kinds can't share a pool.
+    Crashed workers are restarted, SIGTERM and SIGINT stop the pool after running jobs are finished
+    """
+
+    def __init__(
+            self,
+            workers: int,
+            workflow_classes: list[str] = None,
+            lease_timeout: int = DEFAULT_LEASE_TIMEOUT,
+            stats_interval: float = STATS_INTERVAL,
+            shutdown_timeout: float = SHUTDOWN_TIMEOUT,
+            metrics_port: int = None,
+            concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        self.slots = [WorkerSlot(index) for index in range(workers)]
+        self.is_async = self.is_async_pool(workflow_classes)
+        self.manager_kwargs = {
+            'workflow_classes': workflow_classes,
+            'lease_timeout': lease_timeout,
+        }
+        if self.is_async:
+            self.manager_kwargs['concurrency'] = concurrency
+        self.stats_interval = stats_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.metrics_port = metrics_port
+        self.stopping = False
+        self.reported_at = None
+
+    def is_async_pool(self, workflow_classes: list[str] = None) -> bool:
+        # without a filter workers are sync and leave jobs of async workflows to async managers
+        if not workflow_classes:
+            return False
+
+        kinds = {
+            issubclass(workflow_registry.get_class(workflow_class), AsyncWorkflow)
+            for workflow_class in workflow_classes
+        }
+        if len(kinds) > 1:
+            raise ValueError('Sync and async workflows must run in separate pools')
+        return kinds.pop()
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.reported_at = monotonic()
+        try:
+            while not self.stopping:
+                for slot in self.slots:
+                    self.supervise(slot)
+
+                if monotonic() - self.reported_at >= self.stats_interval:
+                    self.report()
+
+                sleep(SUPERVISE_INTERVAL)
+        finally:
+            self.shutdown()
+            self.report()
+
+    def supervise(self, slot: WorkerSlot):
+        if slot.process is not None:
+            if slot.process.is_alive():
+                return
+
+            uptime = monotonic() - slot.started_at
+            logging.warning(f'Worker {slot.index} exited with code {slot.process.exitcode} after {uptime:.0f}s')
+            slot.process.close()
+            slot.process = None
+
+            if uptime >= MIN_UPTIME:
+                slot.backoff.reset()
+            slot.restart_at = monotonic() + slot.backoff.next()
+            slot.restarts += 1
+
+        if slot.restart_at and monotonic() < slot.restart_at:
+            return
+
+        self.start(slot)
+
+    def start(self, slot: WorkerSlot):
+        # forked workers must open their own connections instead of sharing sockets of the supervisor
+        connections.close_all()
+
+        slot.process = context.Process(
+            target=run_worker,
+            args=(slot, self.manager_kwargs, self.metrics_port, self.is_async),
+            name=f'workflows-worker-{slot.index}',
+        )
+        slot.process.start()
+        slot.started_at = monotonic()
+        slot.restart_at = None
+
+    def shutdown(self):
+        running = [slot.process for slot in self.slots if slot.process is not None and slot.process.is_alive()]
+        logging.info(f'Stopping {len(running)} workers')
+
+        for process in running:
+            process.terminate()
+
+        deadline = monotonic() + self.shutdown_timeout
+        for process in running:
+            process.join(max(deadline - monotonic(), 0))
+            if process.is_alive():
+                # its job stays claimed until the lease expires and another worker takes it
+                logging.warning(f'Worker {process.name} did not stop in time, killing it')
+                process.kill()
+                process.join()
+
+    def report(self):
+        elapsed = max(monotonic() - self.reported_at, 1e-9)
+        self.reported_at = monotonic()
+
+        total = 0
+        for slot in self.slots:
+            jobs = slot.jobs.value
+            rate = (jobs - slot.reported_jobs) / elapsed
+            slot.reported_jobs = jobs
+            total += rate
+            pid = slot.process.pid if slot.process is not None else None
+            logging.info(
+                f'Worker {slot.index} (pid {pid}): {jobs} jobs, {rate:.2f} jobs/sec, '
+                f'{slot.errors.value} errors, {slot.restarts} restarts',
+            )
+
+        logging.info(f'Pool throughput: {total:.2f} jobs/sec')
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from math import isfinite
+from time import monotonic, time
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+from workflows.models import Job
+
+PROGRESS_PREFIX = 'workflows:progress'
+# progress of a stuck or crashed transfer disappears from Redis after this time
+PROGRESS_TTL = 60 * 60
+REPORT_INTERVAL = 2
+REPORT_STEP = 5
+# weight of the latest speed sample in the moving average
+SPEED_SMOOTHING = 0.3
+# samples of shorter intervals are merged, chunks arrive in bursts
+MIN_SAMPLE_INTERVAL = 0.5
+
+
+class ProgressStore:
+    """Live progress of running jobs in Redis, so progress ticks never reach Postgres"""
+
+    def __init__(self, url: str = None, ttl: int = PROGRESS_TTL):
+        self.url = url
+        self.ttl = ttl
+        self.client = None
+        self.async_client = None
+        self.async_loop = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.url)
+
+    def get_key(self, job_id: int) -> str:
+        return f'{PROGRESS_PREFIX}:{job_id}'
+
+    def get_client(self) -> redis.Redis:
+        if self.client is None:
+            self.client = redis.Redis.from_url(self.url, decode_responses=True)
+        return self.client
+
+    def get_async_client(self) -> redis.asyncio.Redis:
+        # connections of the async client belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        if self.async_loop is not loop:
+            self.async_client = redis.asyncio.Redis.from_url(self.url, decode_responses=True)
+            self.async_loop = loop
+        return self.async_client
+
+    def write(self, job_id: int, state: dict):
+        with self.get_client().pipeline() as pipeline:
+            pipeline.hset(self.get_key(job_id), mapping=state)
+            pipeline.expire(self.get_key(job_id), self.ttl)
+            pipeline.execute()
+
+    async def awrite(self, job_id: int, state: dict):
+        async with self.get_async_client().pipeline() as pipeline:
+            pipeline.hset(self.get_key(job_id), mapping=state)
+            pipeline.expire(self.get_key(job_id), self.ttl)
+            await pipeline.execute()
+
+    def read(self, job_id: int) -> dict | None:
+        if not self.enabled:
+            return None
+        try:
+            state = self.get_client().hgetall(self.get_key(job_id))
+        except redis.RedisError as e:
+            logging.warning(f'Failed to read progress of job {job_id}: {e}')
+            return None
+        return {key: float(value) for key, value in state.items()} or None
+
+
+progress_store = ProgressStore(settings.WORKFLOWS_REDIS_URL)
+
+
+class ProgressReporter:
+    """
+    Tracks one transfer of a job: moving average speed and ETA.
+    Reports are coalesced, at most every interval seconds or step percent, and go to Redis when it's configured.
+    The final report is stored in JobProgress.
+    Its update and aupdate methods fit Telethon progress callbacks
+    """
+
+    def __init__(
+            self,
+            workflow,
+            job: Job,
+            interval: float = REPORT_INTERVAL,
+            step: float = REPORT_STEP,
+            smoothing: float = SPEED_SMOOTHING,
+            store: ProgressStore = progress_store,
+    ):
+        self.workflow = workflow
+        self.job = job
+        self.interval = interval
+        self.step = step
+        self.smoothing = smoothing
+        self.store = store
+
+        self.current = 0
+        self.total = 0
+        self.speed = None
+        self.sampled_at = monotonic()
+        self.sampled = 0
+        self.reported_at = None
+        self.reported_percentage = None
+
+    @property
+    def percentage(self) -> float:
+        return self.current / self.total * 100 if self.total else 0
+
+    @property
+    def eta(self) -> float | None:
+        if not self.speed or not self.total:
+            return None
+        eta = max(self.total - self.current, 0) / self.speed
+        return eta if isfinite(eta) else None
+
+    def track(self, current: int, total: int = None) -> bool:
+        """Takes a new position, returns whether it's time to report"""
+        self.current = current
+        self.total = total or self.total
+
+        elapsed = monotonic() - self.sampled_at
+        if elapsed >= MIN_SAMPLE_INTERVAL:
+            sample = (current - self.sampled) / elapsed
+            if self.speed is None:
+                self.speed = sample
+            else:
+                self.speed = self.smoothing * sample + (1 - self.smoothing) * self.speed
+            self.sampled_at = monotonic()
+            self.sampled = current
+
+        if self.reported_at is None:
+            return True
+        if monotonic() - self.reported_at >= self.interval:
+            return True
+        return bool(self.total) and self.percentage - self.reported_percentage >= self.step
+
+    def get_state(self) -> dict:
+        state = {
+            'current': self.current,
+            'total': self.total,
+            'updated_at': time(),
+        }
+        if self.speed is not None:
+            state['speed'] = self.speed
+        if self.eta is not None:
+            state['eta'] = self.eta
+        return state
+
+    def mark_reported(self):
+        self.reported_at = monotonic()
+        self.reported_percentage = self.percentage
+
+    def update(self, current: int, total: int = None):
+        if not self.track(current, total):
+            return
+        self.mark_reported()
+
+        if self.store.enabled:
+            try:
+                self.store.write(self.job.id, self.get_state())
+            except redis.RedisError as e:
+                logging.warning(f'Failed to report progress of job {self.job.id}: {e}')
+            else:
+                return
+
+        self.workflow.update_job_progress(self.job, self.current, self.total, self.speed, self.eta)
+
+    async def aupdate(self, current: int, total: int = None):
+        if not self.track(current, total):
+            return
+        self.mark_reported()
+
+        if self.store.enabled:
+            try:
+                await self.store.awrite(self.job.id, self.get_state())
+            except redis.RedisError as e:
+                logging.warning(f'Failed to report progress of job {self.job.id}: {e}')
+            else:
+                return
+
+        await self.workflow.update_job_progress(self.job, self.current, self.total, self.speed, self.eta)
+
+    def finish(self):
+        self.workflow.update_job_progress(self.job, self.current, self.total, self.speed, self.eta)
+
+    async def afinish(self):
+        await self.workflow.update_job_progress(self.job, self.current, self.total, self.speed, self.eta)
@@ -0,0 +1,139 @@
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+from threading import Lock
+from time import monotonic
+
+import redis
+from django.conf import settings
+
+from workflows.models import Job, Process
+
+BUCKET_PREFIX = 'workflows:rate'
+
+# refills the buckets by elapsed time and takes a token of each one when all of them have it,
+# otherwise takes nothing and returns seconds to wait for the emptiest bucket
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local current = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local buckets = {}
+local wait = 0
+for index, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[index * 2 - 1])
+    local capacity = tonumber(ARGV[index * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or current
+    tokens = math.min(capacity, tokens + math.max(current - updated_at, 0) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    buckets[index] = {key, tokens, math.ceil(capacity / rate) + 1}
+end
+for _, bucket in ipairs(buckets) do
+    local tokens = bucket[2]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', bucket[1], 'tokens', tostring(tokens), 'updated_at', tostring(current))
+    redis.call('EXPIRE', bucket[1], bucket[3])
+end
+return tostring(wait)
+"""  # noqa: S105
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    Token bucket of limit jobs per period seconds allowing bursts of burst jobs.
+    Jobs share a bucket by name (stage by default) and the key built from the job,
+    e.g. key=lambda process, job: process.data['sender_account_id']
+    """
+
+    limit: float
+    period: float = 1
+    burst: int = 1
+    name: str = None
+    key: Callable[[Process, Job], object] = None
+
+    @property
+    def rate(self) -> float:
+        return self.limit / self.period
+
+    def get_bucket(self, process: Process, job: Job) -> str:
+        bucket = f'{BUCKET_PREFIX}:{self.name or job.stage}'
+        if self.key:
+            bucket = f'{bucket}:{self.key(process, job)}'
+        return bucket
+
+
+class MemoryBuckets:
+    """Token buckets of this process only"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = Lock()
+
+    def acquire(self, buckets: list[tuple[str, float, int]]) -> float:
+        """Takes a token of every bucket given as (name, rate, capacity), or none when one of them is empty"""
+        current = monotonic()
+        with self.lock:
+            refilled = {}
+            wait = 0
+            for bucket, rate, capacity in buckets:
+                tokens, updated_at = self.buckets.get(bucket, (capacity, current))
+                tokens = min(capacity, tokens + (current - updated_at) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                refilled[bucket] = tokens
+
+            for bucket, tokens in refilled.items():
+                self.buckets[bucket] = (tokens if wait else tokens - 1, current)
+            return wait
+
+
+class RedisBuckets:
+    """Token buckets shared by all workers, kept in Redis and updated atomically with a script"""
+
+    def __init__(self, url: str):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self, buckets: list[tuple[str, float, int]]) -> float:
+        args = []
+        for _, rate, capacity in buckets:
+            args += [rate, capacity]
+        return float(self.script(keys=[bucket for bucket, _, _ in buckets], args=args))
+
+
+class RateLimiter:
+    """
+    Takes tokens of rate limits of a job before it runs, all of them at once,
+    so a throttled job doesn't use up limits it has passed.
+    Falls back to in-memory buckets when Redis isn't configured or fails
+    """
+
+    def __init__(self, redis_url: str = None):
+        self.redis_url = redis_url
+        self.memory = MemoryBuckets()
+        self.redis = None
+
+    def get_buckets(self):
+        if self.redis is None and self.redis_url:
+            self.redis = RedisBuckets(self.redis_url)
+        return self.redis or self.memory
+
+    def throttle(self, limits: tuple[RateLimit, ...], process: Process, job: Job) -> float:
+        """Seconds the job has to wait, zero when it may run now"""
+        if not limits:
+            return 0
+
+        buckets = [(limit.get_bucket(process, job), limit.rate, limit.burst) for limit in limits]
+        try:
+            return self.get_buckets().acquire(buckets)
+        except redis.RedisError as e:
+            logging.warning(f'Rate limiter Redis failed, using limits of this worker only: {e}')
+            return self.memory.acquire(buckets)
+
+
+rate_limiter = RateLimiter(settings.WORKFLOWS_REDIS_URL)
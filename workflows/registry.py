@@ -0,0 +1,78 @@
+from collections import OrderedDict
+
+from django.utils.module_loading import import_string
+
+from workflows.workflow import Workflow
+
+MAX_INSTANCES = 200
+
+
+class WorkflowRegistry:
+    """
+    Resolves workflow classes and stages once per worker
+    and keeps a long-lived workflow instance per process,
+    so caches of a workflow survive across jobs of the same process
+    """
+
+    def __init__(self, max_instances: int = MAX_INSTANCES):
+        self.max_instances = max_instances
+        self.classes = {}
+        self.stages = {}
+        self.instances = OrderedDict()
+
+    def get_class(self, workflow_class: str) -> type[Workflow]:
+        if workflow_class not in self.classes:
+            try:
+                resolved = import_string(workflow_class)
+            except (ModuleNotFoundError, ImportError):
+                raise Exception(f'Workflow isn`t found in {workflow_class}')
+
+            if not isinstance(resolved, type) or not issubclass(resolved, Workflow):
+                raise TypeError(f'Class {workflow_class} isn`t instance of Workflow')
+
+            self.classes[workflow_class] = resolved
+
+        return self.classes[workflow_class]
+
+    def get_instance(self, workflow_class: str, process_id: int = None) -> Workflow:
+        key = (workflow_class, process_id)
+
+        if key in self.instances:
+            self.instances.move_to_end(key)
+            return self.instances[key]
+
+        workflow = self.get_class(workflow_class)()
+        self.instances[key] = workflow
+
+        # least recently used instances go first, normally they are evicted when their process ends
+        while len(self.instances) > self.max_instances:
+            self.instances.popitem(last=False)
+
+        return workflow
+
+    def get_stage(self, workflow: Workflow, stage: str):
+        key = (workflow.__class__, stage)
+
+        if key not in self.stages:
+            function = getattr(workflow.__class__, stage, None)
+            if not callable(function):
+                raise AttributeError(f'Stage {stage} isn`t found in {workflow.__class__.__name__}')
+            self.stages[key] = function
+
+        return self.stages[key].__get__(workflow)
+
+    def evict(self, workflow_class: str = None, process_id: int = None):
+        for key in list(self.instances):
+            if workflow_class and key[0] != workflow_class:
+                continue
+            if process_id and key[1] != process_id:
+                continue
+            del self.instances[key]
+
+    def clear(self):
+        self.classes.clear()
+        self.stages.clear()
+        self.instances.clear()
+
+
+workflow_registry = WorkflowRegistry()
@@ -0,0 +1,108 @@
+import gzip
+import json
+from base64 import b64encode
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.timezone import now
+
+from workflows.constants import PROCESS_DONE, PROCESS_FAILED
+from workflows.models import Job, JobLog, JobProgress, Process, ProcessLog
+
+ARCHIVE_BATCH_SIZE = 100
+
+
+def get_expired_processes(older_than: timedelta):
+    return Process.objects.filter(
+        status__in=(PROCESS_DONE, PROCESS_FAILED),
+        done_at__lt=now() - older_than,
+    ).order_by('id')
+
+
+def dump_processes(process_ids: list[int]) -> list[dict]:
+    """Process records with their logs, jobs, job logs and job parents"""
+    process_logs = defaultdict(list)
+    for log in ProcessLog.objects.filter(process_id__in=process_ids).order_by('id').values():
+        process_logs[log['process_id']].append(log)
+
+    job_logs = defaultdict(list)
+    for log in JobLog.objects.filter(job__process_id__in=process_ids).order_by('id').values():
+        job_logs[log['job_id']].append(log)
+
+    job_parents = defaultdict(list)
+    for from_job_id, to_job_id in Job.parents.through.objects.filter(
+            from_job__process_id__in=process_ids,
+    ).values_list('from_job_id', 'to_job_id'):
+        job_parents[from_job_id].append(to_job_id)
+
+    jobs = defaultdict(list)
+    for job in Job.objects.filter(process_id__in=process_ids).order_by('id').values():
+        jobs[job['process_id']].append({
+            **job,
+            'payload': b64encode(job['payload']).decode() if job['payload'] else None,
+            'parents': job_parents[job['id']],
+            'logs': job_logs[job['id']],
+        })
+
+    return [
+        {
+            **process,
+            'logs': process_logs[process['id']],
+            'jobs': jobs[process['id']],
+        }
+        for process in Process.objects.filter(id__in=process_ids).order_by('id').values()
+    ]
+
+
+def prune_processes(process_ids: list[int]):
+    # children first, jobs protect their process from deletion
+    JobLog.objects.filter(job__process_id__in=process_ids).delete()
+    JobProgress.objects.filter(job__process_id__in=process_ids).delete()
+    Job.parents.through.objects.filter(from_job__process_id__in=process_ids).delete()
+    Job.objects.filter(process_id__in=process_ids).delete()
+    ProcessLog.objects.filter(process_id__in=process_ids).delete()
+    Process.objects.filter(id__in=process_ids).delete()
+
+
+def archive_processes(
+        older_than: timedelta,
+        archive_dir: Path | None,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """
+    Moves finished processes older than the given age to a gzipped JSONL file
+    and removes them from the database batch by batch.
+    Without archive_dir processes are only removed
+    """
+    processes = get_expired_processes(older_than)
+
+    archive = None
+    if archive_dir:
+        archive_dir = Path(archive_dir)
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = archive_dir / f'processes-{now():%Y%m%d-%H%M%S}.jsonl.gz'
+        archive = gzip.open(archive_path, 'at')
+
+    archived = 0
+    try:
+        while process_ids := list(processes.values_list('id', flat=True)[:batch_size]):
+            with transaction.atomic():
+                if archive:
+                    for record in dump_processes(process_ids):
+                        archive.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+                    # records are on disk before their rows are deleted
+                    archive.flush()
+
+                prune_processes(process_ids)
+
+            archived += len(process_ids)
+    finally:
+        if archive:
+            archive.close()
+            if not archived:
+                archive_path.unlink()
+
+    return archived
@@ -0,0 +1,35 @@
+import random
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How a failed job is retried: exponential backoff with jitter, up to max_attempts (None is unlimited).
+    Errors telling how long to wait, like FloodWaitError.seconds, are retried exactly after that time
+    """
+
+    max_attempts: int | None = 10
+    base_delay: float = 60
+    multiplier: float = 2
+    max_delay: float = 60 * 60
+    jitter: float = 0.1
+    # the policy handles only these errors, see Workflow.get_retry_policy
+    retry_on: tuple[type[BaseException], ...] = (Exception,)
+    honour_wait: bool = True
+
+    def handles(self, err: BaseException) -> bool:
+        return isinstance(err, self.retry_on)
+
+    def get_delay(self, attempts: int, err: BaseException = None) -> float | None:
+        """Seconds until the next attempt after the given number of failed ones, None when exhausted"""
+        if self.max_attempts is not None and attempts >= self.max_attempts:
+            return None
+
+        wait = getattr(err, 'seconds', None) if self.honour_wait else None
+        if isinstance(wait, int | float) and wait > 0:
+            # the server said when, earlier attempts fail again
+            return wait + 1
+
+        delay = min(self.base_delay * self.multiplier ** max(attempts - 1, 0), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)  # noqa: S311
@@ -0,0 +1,14 @@
+from datetime import timedelta
+
+from django.conf import settings
+
+from app.celery import LoggingTask, app
+from workflows.retention import archive_processes
+
+
+@app.task(base=LoggingTask)
+def archive_finished_processes():
+    return archive_processes(
+        timedelta(days=settings.WORKFLOWS_RETENTION_DAYS),
+        settings.WORKFLOWS_ARCHIVE_DIR,
+    )
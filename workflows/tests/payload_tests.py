@@ -0,0 +1,118 @@
+import pytest
+from django.contrib import admin
+
+from workflows.admin import JobAdmin
+from workflows.constants import JOB_PLANNED
+from workflows.manager import manager
+from workflows.models import Job
+from workflows.payload import PayloadSchema
+from workflows.workflow import Workflow
+
+SCHEMA = PayloadSchema(channel_id='int', ratio='float', done='bool', title='str')
+
+
+class PayloadWorkflow(Workflow):
+    payload_schemas = {'step': SCHEMA}
+
+    def step(self, process, job):
+        self.done_job(job)
+
+    def plain(self, process, job):
+        self.done_job(job)
+
+
+def test_round_trip():
+    data = {'channel_id': -1001234567890, 'ratio': 0.25, 'done': True, 'title': 'Привет', 'other': [1]}
+
+    rest, payload = SCHEMA.pack(data)
+
+    assert rest == {'other': [1]}
+    assert SCHEMA.unpack(payload) == {'channel_id': -1001234567890, 'ratio': 0.25, 'done': True, 'title': 'Привет'}
+
+
+def test_missing_fields_are_skipped():
+    rest, payload = SCHEMA.pack({'done': False})
+
+    assert rest == {}
+    assert SCHEMA.unpack(payload) == {'done': False}
+
+
+def test_nothing_to_pack():
+    assert SCHEMA.pack({'other': 1}) == ({'other': 1}, None)
+
+
+@pytest.mark.parametrize('data', [
+    {'ratio': 1},
+    {'channel_id': True},
+    {'channel_id': 2 ** 63},
+    {'channel_id': None},
+    {'title': 'x' * 2 ** 16},
+])
+def test_mismatched_values_stay_in_json(data):
+    assert SCHEMA.pack(data) == (data, None)
+
+
+def test_appended_fields_read_old_payloads():
+    old = PayloadSchema(**{f'field_{index}': 'int' for index in range(8)})
+    new = PayloadSchema(**{f'field_{index}': 'int' for index in range(9)})
+    data = {f'field_{index}': index for index in range(8)}
+
+    _, payload = old.pack(data)
+
+    assert new.unpack(payload) == data
+
+
+def test_new_payloads_keep_appended_fields():
+    old = PayloadSchema(channel_id='int')
+    new = PayloadSchema(channel_id='int', message_id='int')
+
+    _, payload = new.pack({'channel_id': 1, 'message_id': 2})
+
+    assert new.unpack(payload) == {'channel_id': 1, 'message_id': 2}
+    assert old.unpack(payload) == {'channel_id': 1}
+
+
+def test_too_many_fields():
+    with pytest.raises(ValueError):
+        PayloadSchema(**{f'field_{index}': 'int' for index in range(65)})
+
+
+@pytest.mark.django_db
+def test_created_jobs_have_their_data():
+    workflow = PayloadWorkflow()
+    process, _ = manager.create_process(None, PayloadWorkflow)
+    data = {'channel_id': 1, 'ratio': 0.5, 'other': 'x'}
+
+    job = workflow.create_job(process=process, stage='step', data=data, status=JOB_PLANNED)
+    (bulk_job,) = workflow.create_jobs_bulk(process, [{'stage': 'step', 'data': data, 'status': JOB_PLANNED}])
+
+    assert job.data == data
+    assert bulk_job.data == data
+    bulk_job.refresh_from_db()
+    assert bulk_job.data == {'other': 'x'}
+    assert workflow.load_job_data(bulk_job).data == data
+
+
+@pytest.mark.django_db
+def test_admin_finds_ids_in_payloads():
+    workflow = PayloadWorkflow()
+    process, _ = manager.create_process(None, PayloadWorkflow)
+    job = workflow.create_job(process=process, stage='step', data={'channel_id': 1001234567890}, status=JOB_PLANNED)
+    flag = workflow.create_job(process=process, stage='step', data={'done': True}, status=JOB_PLANNED)
+    job_admin = JobAdmin(Job, admin.site)
+
+    results, _ = job_admin.get_search_results(None, Job.objects.all(), '1001234567890')
+    flags, _ = job_admin.get_search_results(None, Job.objects.filter(id=flag.id), '1')
+
+    assert list(results) == [job]
+    assert list(flags) == []
+
+
+@pytest.mark.django_db
+def test_admin_payload_of_stage_without_schema():
+    workflow = PayloadWorkflow()
+    process, _ = manager.create_process(None, PayloadWorkflow)
+    job = workflow.create_job(process=process, stage='plain', data={'channel_id': 1}, status=JOB_PLANNED)
+    job.payload = SCHEMA.pack({'channel_id': 1})[1]
+
+    assert JobAdmin(Job, admin.site).payload_data(job) is None
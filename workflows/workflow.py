@@ -1,6 +1,10 @@
 import logging
+from collections import Counter
+from contextlib import contextmanager
 
-from django.db import transaction
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.db.models import F
 from django.utils.timezone import now
 
 from workflows.constants import (
@@ -11,7 +15,89 @@ from workflows.constants import (
     PROCESS_DONE,
     PROCESS_FAILED,
 )
-from workflows.models import Job, JobLog, Process, ProcessLog
+from workflows.logs import log_writer
+from workflows.models import Job, JobLog, JobProgress, Process, ProcessLog
+from workflows.notifications import anotify_jobs, notify_jobs
+from workflows.payload import PayloadSchema
+from workflows.progress import ProgressReporter
+from workflows.rate_limit import RateLimit
+from workflows.retry import RetryPolicy
+
+BULK_BATCH_SIZE = 1000
+
+
+@transaction.atomic
+def activate_ready_children(job: Job) -> list[int]:
+    """
+    Activates planned children of the job whose parents are all successful.
+    Returns ids of activated jobs
+    """
+    jobs_table = Job._meta.db_table  # noqa: SLF001
+    parents_table = Job.parents.through._meta.db_table  # noqa: SLF001
+
+    with connection.cursor() as cursor:
+        # lock children first: a parent finishing concurrently in another transaction
+        # has to commit before the update below takes its snapshot, otherwise nobody activates fan-in children
+        cursor.execute(
+            f"""
+            SELECT id FROM {jobs_table}
+            WHERE status = %s AND id IN (SELECT from_job_id FROM {parents_table} WHERE to_job_id = %s)
+            FOR UPDATE
+            """,  # noqa: S608
+            [JOB_PLANNED, job.id],
+        )
+        if not cursor.fetchall():
+            return []
+
+        cursor.execute(
+            f"""
+            UPDATE {jobs_table} AS child SET status = %s
+            WHERE child.status = %s
+                AND child.id IN (SELECT from_job_id FROM {parents_table} WHERE to_job_id = %s)
+                AND NOT EXISTS (
+                    SELECT 1 FROM {parents_table} AS edge
+                    JOIN {jobs_table} AS parent ON parent.id = edge.to_job_id
+                    WHERE edge.from_job_id = child.id AND parent.status <> %s
+                )
+            RETURNING child.id
+            """,  # noqa: S608
+            [JOB_ACTIVE, JOB_PLANNED, job.id, JOB_SUCCESS],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+@transaction.atomic
+def fail_planned_descendants(job: Job, update_counters: bool = True) -> list[int]:
+    """
+    Fails planned jobs downstream of a failed job, they could never be activated.
+    Returns ids of failed jobs
+    """
+    jobs_table = Job._meta.db_table  # noqa: SLF001
+    parents_table = Job.parents.through._meta.db_table  # noqa: SLF001
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH RECURSIVE descendants(id) AS (
+                SELECT from_job_id FROM {parents_table} WHERE to_job_id = %s
+                UNION
+                SELECT edge.from_job_id FROM {parents_table} AS edge
+                JOIN descendants ON edge.to_job_id = descendants.id
+            )
+            UPDATE {jobs_table} SET status = %s, done_at = %s
+            WHERE status = %s AND id IN (SELECT id FROM descendants)
+            RETURNING id
+            """,  # noqa: S608
+            [job.id, JOB_FAILED, now(), JOB_PLANNED],
+        )
+        failed = [row[0] for row in cursor.fetchall()]
+
+    if failed and update_counters:
+        Process.objects.filter(id=job.process_id).update(
+            jobs_pending=F('jobs_pending') - len(failed),
+            jobs_failed=F('jobs_failed') + len(failed),
+        )
+    return failed
 
 
 class ContextualLogger(logging.LoggerAdapter):
@@ -24,14 +110,91 @@ class ContextualLogger(logging.LoggerAdapter):
         return f'[Process: {self.extra["process"]}] [Job: {self.extra["job"]}] {msg}', kwargs
 
 
+@transaction.atomic
+def insert_job(process: Process, parents: list, **fields) -> Job:
+    """Creates a job together with its parent links and the pending counter of its process"""
+    job = Job.objects.create(process=process, **fields)
+    job.parents.set(parents)
+    Process.objects.filter(id=process.id).update(jobs_pending=F('jobs_pending') + 1)
+    return job
+
+
+@transaction.atomic
+def save_job_status(job: Job, **counters: int) -> bool:
+    """
+    Saves the final status of an unfinished job and the counters of its process in one transaction.
+    Returns false when the job was already finished, then the counters are left as they are
+    """
+    updated = Job.objects.filter(id=job.id, status__in=(JOB_ACTIVE, JOB_PLANNED)).update(
+        status=job.status,
+        done_at=job.done_at,
+    )
+    if updated:
+        Process.objects.filter(id=job.process_id).update(
+            **{f'jobs_{name}': F(f'jobs_{name}') + value for name, value in counters.items()},
+        )
+    return bool(updated)
+
+
 class Workflow:
     default_stage = 'prepare'
     service_class = None
 
+    # priority of new processes, interactive workflows should outrank bulk ones
+    priority = 0
+
+    # limits of simultaneously running jobs in AsyncManager, e.g. {'download_media': 4}
+    concurrency = None
+    stage_concurrency = {}
+
+    # retry policies of failed jobs by stage, a policy or a tuple of them where the first one handling the error wins
+    retry_policies = {}
+    default_retry_policy = RetryPolicy()
+
+    # token buckets by stage, a limit or a tuple of them, throttled jobs are postponed without running
+    rate_limits = {}
+
+    # typed data fields by stage, stored packed in Job.payload instead of the JSON data
+    payload_schemas: dict[str, PayloadSchema] = {}
+
+    # counter deltas and done checks by process id, collected while a stage runs in batch_job_counters
+    counter_batch = None
+
     def get_logger(self, process, job=None):
         logger = logging.getLogger(__name__)
         return ContextualLogger(logger, {'process': process, 'job': job})
 
+    def get_retry_policy(self, job: Job, err: BaseException) -> RetryPolicy | None:
+        policies = self.retry_policies.get(job.stage, ())
+        if isinstance(policies, RetryPolicy):
+            policies = (policies,)
+
+        for policy in (*policies, self.default_retry_policy):
+            if policy.handles(err):
+                return policy
+
+        return None
+
+    @classmethod
+    def get_rate_limits(cls, stage: str) -> tuple[RateLimit, ...]:
+        limits = cls.rate_limits.get(stage, ())
+        if isinstance(limits, RateLimit):
+            limits = (limits,)
+        return limits
+
+    def split_job_data(self, stage: str, data: dict) -> tuple[dict, bytes | None]:
+        schema = self.payload_schemas.get(stage)
+        if not schema or not data:
+            return data or {}, None
+        return schema.pack(data)
+
+    def load_job_data(self, job: Job) -> Job:
+        """Merges the packed payload back into job.data, the manager does it before running a stage"""
+        schema = self.payload_schemas.get(job.stage)
+        if schema and job.payload:
+            job.data = {**schema.unpack(job.payload), **job.data}
+        return job
+
     @transaction.atomic
     def create_job(
             self,
@@ -40,27 +203,87 @@ class Workflow:
             data: dict = None,
             parents=None,
             status=JOB_ACTIVE,
+            priority: int = None,
     ) -> Job:
         assert hasattr(self, stage) and callable(getattr(self, stage))  # noqa: S101
 
         if parents is None:
             parents = []
 
+        data, payload = self.split_job_data(stage, data)
         job = Job.objects.create(
             process=process,
             stage=stage,
-            data=data or {},
+            data=data,
+            payload=payload,
             status=status,
+            priority=process.priority if priority is None else priority,
         )
+        self.load_job_data(job)
 
         job.parents.set(
             parents,
         )
 
+        self.update_job_counters(process, pending=1)
         self.job_log(job, 'Job created')
 
+        if status == JOB_ACTIVE:
+            notify_jobs()
+
         return job
 
+    @transaction.atomic
+    def create_jobs_bulk(self, process: Process, jobs: list[dict]) -> list[Job]:
+        """
+        Creates a DAG of jobs with a few bulk queries.
+        Each spec is a dict with stage, data, status, priority, key and parents,
+        where parents are existing jobs or keys of other specs from the list
+        """
+        for spec in jobs:
+            assert hasattr(self, spec['stage']) and callable(getattr(self, spec['stage']))  # noqa: S101
+
+        new_jobs = []
+        for spec in jobs:
+            data, payload = self.split_job_data(spec['stage'], spec.get('data'))
+            new_jobs.append(Job(
+                process=process,
+                stage=spec['stage'],
+                data=data,
+                payload=payload,
+                status=spec.get('status', JOB_ACTIVE),
+                priority=spec.get('priority', process.priority),
+            ))
+
+        created = [self.load_job_data(job) for job in Job.objects.bulk_create(new_jobs, batch_size=BULK_BATCH_SIZE)]
+
+        by_key = {spec['key']: job for spec, job in zip(jobs, created, strict=True) if spec.get('key') is not None}
+
+        edges = set()
+        for spec, job in zip(jobs, created, strict=True):
+            for parent in spec.get('parents') or ():
+                parent_job = parent if isinstance(parent, Job) else by_key[parent]
+                edges.add((job.id, parent_job.id))
+
+        Job.parents.through.objects.bulk_create(
+            [Job.parents.through(from_job_id=from_job_id, to_job_id=to_job_id) for from_job_id, to_job_id in edges],
+            batch_size=BULK_BATCH_SIZE,
+        )
+
+        # inlined, the counters method is async in AsyncWorkflow and this code always runs synchronously
+        Process.objects.filter(id=process.id).update(jobs_pending=F('jobs_pending') + len(created))
+
+        JobLog.objects.bulk_create(
+            [JobLog(job=job, message='Job created') for job in created],
+            batch_size=BULK_BATCH_SIZE,
+        )
+        self.get_logger(process).info(f'{len(created)} jobs created')
+
+        if any(job.status == JOB_ACTIVE for job in created):
+            notify_jobs()
+
+        return created
+
     @transaction.atomic
     def activate_job(self, job):
         if job.status == JOB_ACTIVE:
@@ -70,9 +293,46 @@ class Workflow:
             update_fields=('status',),
         )
         self.job_log(job, 'Job activated')
+        notify_jobs()
+
+    @contextmanager
+    def batch_job_counters(self):
+        """
+        Collects counter updates and done checks of a stage and applies them at its end, inside its transaction,
+        so the process row is locked only until the commit instead of for the whole stage
+        """
+        self.counter_batch = {}
+        try:
+            yield
+            batch = self.counter_batch
+        finally:
+            self.counter_batch = None
+
+        for process_id, (deltas, job) in batch.items():
+            if deltas:
+                self.update_job_counters(Process(id=process_id), **deltas)
+            if job:
+                self.check_process_done(job)
+
+    def update_job_counters(self, process: Process, pending: int = 0, success: int = 0, failed: int = 0):
+        if self.counter_batch is not None:
+            deltas, _ = self.counter_batch.setdefault(process.id, (Counter(), None))
+            deltas.update(pending=pending, success=success, failed=failed)
+            return
+
+        Process.objects.filter(id=process.id).update(
+            jobs_pending=F('jobs_pending') + pending,
+            jobs_success=F('jobs_success') + success,
+            jobs_failed=F('jobs_failed') + failed,
+        )
 
     def check_process_done(self, job):
-        if not Job.objects.filter(process=job.process).exclude(status__in=(JOB_SUCCESS, JOB_FAILED)).exists():
+        if self.counter_batch is not None:
+            deltas, _ = self.counter_batch.setdefault(job.process_id, (Counter(), None))
+            self.counter_batch[job.process_id] = (deltas, job)
+            return
+
+        if not Process.objects.filter(id=job.process_id, jobs_pending__gt=0).exists():
             # process done
             self.done_process(process=job.process, comment='All jobs done')
 
@@ -90,6 +350,7 @@ class Workflow:
             update_fields=('status', 'done_at'),
         )
 
+        self.update_job_counters(job.process, pending=-1, success=1)
         self.job_log(job, 'Job done')
 
         if not disable_triggers:
@@ -99,10 +360,15 @@ class Workflow:
 
     @transaction.atomic
     def run_children(self, job: Job):
-        planned_children = job.children.filter(status=JOB_PLANNED).prefetch_related('parents')
-        for child in planned_children:
-            if all(parent.status == JOB_SUCCESS for parent in child.parents.all()):
-                self.activate_job(child)
+        activated = activate_ready_children(job)
+        if not activated:
+            return
+
+        for job_id in activated:
+            log_writer.write(JobLog(job_id=job_id, message='Job activated'))
+        self.get_logger(job.process, job).info(f'{len(activated)} child jobs activated')
+
+        notify_jobs()
 
     @transaction.atomic
     def fail_job(self, job: Job, disable_triggers=False):
@@ -118,15 +384,29 @@ class Workflow:
             update_fields=('status', 'done_at'),
         )
 
+        self.update_job_counters(job.process, pending=-1, failed=1)
         self.job_log(job, 'Job failed')
 
-        for parent in job.parents.all():
+        # successful parents stay as they are, their results are still valid
+        for parent in job.parents.exclude(status=JOB_SUCCESS):
             if parent.stage != self.default_stage:
                 self.fail_job(parent, disable_triggers=disable_triggers)
 
         if not disable_triggers:
+            self.fail_descendants(job)
             self.check_process_done(job)
 
+    @transaction.atomic
+    def fail_descendants(self, job: Job):
+        failed = fail_planned_descendants(job, update_counters=False)
+        if not failed:
+            return
+
+        self.update_job_counters(job.process, pending=-len(failed), failed=len(failed))
+        for job_id in failed:
+            log_writer.write(JobLog(job_id=job_id, message=f'Job failed: job #{job.id} upstream failed'))
+        self.get_logger(job.process, job).info(f'{len(failed)} planned jobs downstream failed')
+
     @transaction.atomic
     def done_process(self, process: Process, job: Job = None, comment: str = None):
         if job and job.status not in (JOB_SUCCESS, JOB_FAILED):
@@ -139,6 +419,7 @@ class Workflow:
         )
 
         self.process_log(process, f'Process done: {comment}')
+        transaction.on_commit(log_writer.flush)
 
     @transaction.atomic
     def fail_process(self, process: Process, job: Job = None, comment: str = None):
@@ -152,16 +433,36 @@ class Workflow:
         )
 
         self.process_log(process, f'Process failed: {comment}')
+        transaction.on_commit(log_writer.flush)
 
     @transaction.atomic
     def update_job_data(self, job: Job, data: dict):
+        self.load_job_data(job)
         job.data = {**job.data, **data}
-        job.save(
-            update_fields=('data',),
+        stored, job.payload = self.split_job_data(job.stage, job.data)
+        Job.objects.filter(id=job.id).update(
+            data=stored,
+            payload=job.payload,
         )
 
         self.job_log(job, f'Job data updated new data: {data}')
 
+    def get_job_progress(self, job: Job, current: int, total: int, speed: float, eta: float) -> JobProgress:
+        return JobProgress(job=job, current=current, total=total or 0, speed=speed, eta=eta, updated_at=now())
+
+    def get_progress_reporter(self, job: Job, **kwargs) -> ProgressReporter:
+        """Reporter of one transfer, its reports are throttled and go to Redis until it finishes"""
+        return ProgressReporter(self, job, **kwargs)
+
+    def update_job_progress(self, job: Job, current: int, total: int = 0, speed: float = None, eta: float = None):
+        """Upserts the progress row of the job, without touching its data or writing logs"""
+        JobProgress.objects.bulk_create(
+            [self.get_job_progress(job, current, total, speed, eta)],
+            update_conflicts=True,
+            unique_fields=('job',),
+            update_fields=('current', 'total', 'speed', 'eta', 'updated_at'),
+        )
+
     def job_log(
             self,
             job: Job,
@@ -170,9 +471,11 @@ class Workflow:
         logger = self.get_logger(job.process, job)
         logger.info(message)
 
-        JobLog.objects.create(
-            job=job,
-            message=message,
+        log_writer.write(
+            JobLog(
+                job=job,
+                message=message,
+            ),
         )
 
     def process_log(
@@ -183,9 +486,11 @@ class Workflow:
         logger = self.get_logger(process)
         logger.info(message)
 
-        ProcessLog.objects.create(
-            process=process,
-            message=message,
+        log_writer.write(
+            ProcessLog(
+                process=process,
+                message=message,
+            ),
         )
 
 
@@ -193,29 +498,56 @@ class AsyncWorkflow(Workflow):
     default_stage = 'prepare'
     service_class = None
 
-    async def create_job(self, process: Process, stage: str, data: dict = None, parents=None, status=JOB_ACTIVE) -> Job:
+    async def create_job(
+            self,
+            process: Process,
+            stage: str,
+            data: dict = None,
+            parents=None,
+            status=JOB_ACTIVE,
+            priority: int = None,
+    ) -> Job:
         assert hasattr(self, stage) and callable(getattr(self, stage))  # noqa: S101
         if parents is None:
             parents = []
-        job = await Job.objects.acreate(
-            process=process,
+        data, payload = self.split_job_data(stage, data)
+        # the job and the counter are written in one transaction of a sync thread
+        job = await sync_to_async(insert_job)(
+            process,
+            parents,
             stage=stage,
-            data=data or {},
+            data=data,
+            payload=payload,
             status=status,
+            priority=process.priority if priority is None else priority,
         )
-        await job.parents.aset(parents)
+        self.load_job_data(job)
         await self.job_log(job, 'Job created')
+        if status == JOB_ACTIVE:
+            await anotify_jobs()
         return job
 
+    async def create_jobs_bulk(self, process: Process, jobs: list[dict]) -> list[Job]:
+        # async ORM has no transactions, so the whole DAG is written in a sync thread
+        return await sync_to_async(super().create_jobs_bulk)(process, jobs)
+
     async def activate_job(self, job):
         if job.status == JOB_ACTIVE:
             return
         job.status = JOB_ACTIVE
         await job.asave(update_fields=('status',))
         await self.job_log(job, 'Job activated')
+        await anotify_jobs()
+
+    async def update_job_counters(self, process: Process, pending: int = 0, success: int = 0, failed: int = 0):
+        await Process.objects.filter(id=process.id).aupdate(
+            jobs_pending=F('jobs_pending') + pending,
+            jobs_success=F('jobs_success') + success,
+            jobs_failed=F('jobs_failed') + failed,
+        )
 
     async def check_process_done(self, job):
-        if not await Job.objects.filter(process=job.process).exclude(status__in=(JOB_SUCCESS, JOB_FAILED)).aexists():
+        if not await Process.objects.filter(id=job.process_id, jobs_pending__gt=0).aexists():
             await self.done_process(process=job.process, comment='All jobs done')
 
     async def done_job(self, job: Job, disable_triggers=False):
@@ -225,18 +557,23 @@ class AsyncWorkflow(Workflow):
             raise Exception('Cannot mark a failed job as done')
         job.status = JOB_SUCCESS
         job.done_at = now()
-        await job.asave(update_fields=('status', 'done_at'))
+        if not await sync_to_async(save_job_status)(job, pending=-1, success=1):
+            return
         await self.job_log(job, 'Job done')
         if not disable_triggers:
             await self.run_children(job)
             await self.check_process_done(job)
 
     async def run_children(self, job: Job):
-        async for child in job.children.filter(status=JOB_PLANNED).select_related('process').prefetch_related('parents'):
-            if all(
-                    parent.status == JOB_SUCCESS for parent in [p async for p in child.parents.all()]
-            ):
-                await self.activate_job(child)
+        activated = await sync_to_async(activate_ready_children)(job)
+        if not activated:
+            return
+
+        for job_id in activated:
+            await log_writer.awrite(JobLog(job_id=job_id, message='Job activated'))
+        self.get_logger(job.process, job).info(f'{len(activated)} child jobs activated')
+
+        await anotify_jobs()
 
     async def fail_job(self, job: Job, disable_triggers=False):
         if job.status == JOB_FAILED:
@@ -245,14 +582,25 @@ class AsyncWorkflow(Workflow):
             raise Exception('Cannot fail a completed job')
         job.status = JOB_FAILED
         job.done_at = now()
-        await job.asave(update_fields=('status', 'done_at'))
+        if not await sync_to_async(save_job_status)(job, pending=-1, failed=1):
+            return
         await self.job_log(job, 'Job failed')
-        async for parent in job.parents.all():
+        async for parent in job.parents.exclude(status=JOB_SUCCESS):
             if parent.stage != self.default_stage:
                 await self.fail_job(parent, disable_triggers=disable_triggers)
         if not disable_triggers:
+            await self.fail_descendants(job)
             await self.check_process_done(job)
 
+    async def fail_descendants(self, job: Job):
+        failed = await sync_to_async(fail_planned_descendants)(job)
+        if not failed:
+            return
+
+        for job_id in failed:
+            await log_writer.awrite(JobLog(job_id=job_id, message=f'Job failed: job #{job.id} upstream failed'))
+        self.get_logger(job.process, job).info(f'{len(failed)} planned jobs downstream failed')
+
     async def done_process(self, process: Process, job: Job = None, comment: str = None):
         if job and job.status not in (JOB_SUCCESS, JOB_FAILED):
             await self.done_job(job, disable_triggers=True)
@@ -260,6 +608,7 @@ class AsyncWorkflow(Workflow):
         process.done_at = now()
         await process.asave(update_fields=('status', 'done_at'))
         await self.process_log(process, f'Process done: {comment}')
+        await log_writer.aflush()
 
     async def fail_process(self, process: Process, job: Job = None, comment: str = None):
         if job and job.status not in (JOB_SUCCESS, JOB_FAILED):
@@ -268,18 +617,36 @@ class AsyncWorkflow(Workflow):
         process.done_at = now()
         await process.asave(update_fields=('status', 'done_at'))
         await self.process_log(process, f'Process failed: {comment}')
+        await log_writer.aflush()
 
     async def update_job_data(self, job: Job, data: dict):
+        self.load_job_data(job)
         job.data = {**job.data, **data}
-        await job.asave(update_fields=('data',))
+        stored, job.payload = self.split_job_data(job.stage, job.data)
+        await Job.objects.filter(id=job.id).aupdate(data=stored, payload=job.payload)
         await self.job_log(job, f'Job data updated with: {data}')
 
+    async def update_job_progress(
+            self,
+            job: Job,
+            current: int,
+            total: int = 0,
+            speed: float = None,
+            eta: float = None,
+    ):
+        await JobProgress.objects.abulk_create(
+            [self.get_job_progress(job, current, total, speed, eta)],
+            update_conflicts=True,
+            unique_fields=('job',),
+            update_fields=('current', 'total', 'speed', 'eta', 'updated_at'),
+        )
+
     async def job_log(self, job: Job, message: str):
         logger = self.get_logger(job.process, job)
         logger.info(message)
-        await JobLog.objects.acreate(job=job, message=message)
+        await log_writer.awrite(JobLog(job=job, message=message))
 
     async def process_log(self, process: Process, message: str):
         logger = self.get_logger(process)
         logger.info(message)
-        await ProcessLog.objects.acreate(process=process, message=message)
+        await log_writer.awrite(ProcessLog(process=process, message=message))